@@ -1,7 +1,29 @@
+from importlib import import_module
 from .database import db_session, init_db
 from .models import ClimateSample, SentinelSample
 from .sensors import DHT22Sensor
-from .threaded import run_sensor_thread
-from .readout import create_graph, prepare_data, get_last_samples
+from .scheduler import run_scheduler
 from .config import cfg
-from .web import app
+
+
+# readout pulls in matplotlib and scipy, so its functions import it on
+# the first call and the gatherer starts without it. the flask app is
+# imported from baropi.web by the server.
+def lazy(module, name):
+    def call(*args, **kwargs):
+        return getattr(import_module('.' + module, __name__), name)(*args, **kwargs)
+    call.__name__ = call.__qualname__ = name
+    call.__doc__ = "{} from baropi.{}, imported on the first call".format(name, module)
+    return call
+
+
+create_graph = lazy('readout', 'create_graph')
+prepare_data = lazy('readout', 'prepare_data')
+get_last_samples = lazy('readout', 'get_last_samples')
+create_graph_columns = lazy('readout', 'create_graph_columns')
+prepare_columns = lazy('readout', 'prepare_columns')
+get_last_columns = lazy('readout', 'get_last_columns')
+prepare_buckets = lazy('readout', 'prepare_buckets')
+prepare_series = lazy('readout', 'prepare_series')
+get_last_series = lazy('readout', 'get_last_series')
+render_graph = lazy('readout', 'render_graph')
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+sampling delay that follows how fast the readings change
+
+the rate of change of every watched field is the least squares slope of
+the samples of the last window seconds. when a field changes faster
+than its rate per minute, the sensor is read every min_delay seconds
+right away, while the fields stay below half their rate the delay grows
+by relax per sample, up to max_delay.
+"""
+from collections import deque
+from .config import cfg
+
+__all__ = [
+    'AdaptiveRate',
+    'make_adaptive_rate'
+]
+
+
+def slope(points):
+    """least squares slope of (time, value) points, None for fewer than two"""
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_t = sum(t for t, v in points) / n
+    mean_v = sum(v for t, v in points) / n
+    var = sum((t - mean_t) ** 2 for t, v in points)
+    if not var:
+        return None
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / var
+
+
+class AdaptiveRate:
+    # samples kept for the slope even when they are older than the window
+    min_points = 3
+
+    def __init__(self, delay, min_delay, max_delay, rates, window=60, relax=1.5):
+        """
+        :param delay: seconds between reads to begin with
+        :param rates: change per minute that counts as fast, per field
+        """
+        # creation times are unique in whole seconds
+        self.min_delay = max(1, min_delay)
+        self.max_delay = max(max_delay, min_delay)
+        self.delay = min(max(delay, self.min_delay), self.max_delay)
+        self.rates = rates
+        self.window = window
+        self.relax = relax
+        self.history = {field: deque() for field in rates}
+
+    def activity(self, time, values):
+        """the fastest change per minute relative to its rate, and its field"""
+        fastest, field = 0., None
+        for name, rate in self.rates.items():
+            points = self.history[name]
+            value = values.get(name)
+            if value is not None:
+                points.append((time, value))
+            while len(points) > self.min_points and time - points[0][0] > self.window:
+                points.popleft()
+            change = slope(points)
+            if change is not None and abs(change) * 60 / rate > fastest:
+                fastest, field = abs(change) * 60 / rate, name
+        return fastest, field
+
+    def update(self, time, values):
+        """the delay until the next read after a sample of values at time"""
+        activity, field = self.activity(time, values)
+        if activity >= 1:
+            self.delay = self.min_delay
+        elif activity < .5:
+            self.delay = min(self.max_delay, self.delay * self.relax)
+        return self.delay
+
+
+def make_adaptive_rate(Model, delay, overrides=None):
+    """an AdaptiveRate for a sensor storing Model as configured, None if not enabled"""
+    overrides = overrides or {}
+    settings = dict(vars(cfg.adaptive), **overrides)
+    if not settings['enabled']:
+        return None
+    rates = overrides.get('rates')
+    if rates is None:
+        table = getattr(cfg.adaptive.rates, Model.__tablename__, None)
+        rates = vars(table) if table is not None else {}
+    if not rates:
+        return None
+    return AdaptiveRate(
+        delay, settings['min_delay'], settings['max_delay'], rates,
+        settings['window'], settings['relax']
+    )
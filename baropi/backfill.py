@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+fill the stored derived and smoothed columns for existing history
+
+the commands are resumable: they only touch rows whose columns are still
+NULL and commit every chunk, so they can be interrupted and started again.
+"""
+from math import isfinite
+from sqlalchemy import MetaData, Table, Float, inspect, select, bindparam, and_, func
+from . import database as db
+from . import psychrometrics as pm
+from .config import cfg
+from .models import ClimateSample, SentinelSample
+from .smoothing import ExponentialSmoother, smooth_series
+
+__all__ = [
+    'ensure_derived_columns',
+    'ensure_smooth_columns',
+    'backfill_derived',
+    'backfill_smoothed'
+]
+
+
+def ensure_columns(tablename, names, engine=None):
+    """add missing float columns to an existing table"""
+    engine = engine or db.engine
+    present = {c['name'] for c in inspect(engine).get_columns(tablename)}
+    for name in names:
+        if name not in present:
+            print(" +++ adding column", name, "to", tablename)
+            engine.execute(
+                'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    tablename,
+                    name,
+                    Float().compile(dialect=engine.dialect)
+                )
+            )
+
+
+def ensure_derived_columns(engine=None):
+    """add the derived columns to an existing climate table"""
+    ensure_columns(ClimateSample.__tablename__, ClimateSample.derived_fields, engine)
+
+
+def ensure_smooth_columns(engine=None):
+    """add the <field>_smooth columns to the existing sample tables"""
+    for Model in (ClimateSample, SentinelSample):
+        ensure_columns(
+            Model.__tablename__,
+            [field + '_smooth' for field in Model.smooth_fields],
+            engine
+        )
+
+
+def derived_rows(rows):
+    ids, temperature, humidity = zip(*rows)
+    derived = pm.derive(temperature, humidity)
+    for i, _id in enumerate(ids):
+        row = {'_id': _id}
+        for field in ClimateSample.derived_fields:
+            value = float(derived[field][i])
+            row['_' + field] = value if isfinite(value) else None
+        yield row
+
+
+def backfill_derived(chunk_size=5000, engine=None):
+    engine = engine or db.engine
+    ensure_derived_columns(engine)
+    climate = Table(
+        ClimateSample.__tablename__, MetaData(),
+        autoload=True, autoload_with=engine
+    )
+    pending = climate.c.dew_point_celsius.is_(None)
+    update = climate.update().where(
+        climate.c.id == bindparam('_id')
+    ).values(
+        **{field: bindparam('_' + field) for field in ClimateSample.derived_fields}
+    )
+
+    last_id, done = 0, 0
+    while True:
+        # rows without a finite dew point (0% humidity) stay NULL,
+        # so walk by id instead of re-selecting from the start
+        rows = engine.execute(
+            select([climate.c.id, climate.c.temperature, climate.c.humidity])
+            .where(and_(pending, climate.c.id > last_id,
+                        climate.c.temperature.isnot(None),
+                        climate.c.humidity.isnot(None)))
+            .order_by(climate.c.id)
+            .limit(chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        with engine.begin() as conn:
+            conn.execute(update, list(derived_rows(rows)))
+        last_id = rows[-1][0]
+        done += len(rows)
+        print(" +++ backfilled", done, "samples up to id", last_id)
+
+    if not cfg.db.store_derived:
+        print(" --- db.store_derived is disabled, enable it to read the stored values")
+    return done
+
+
+def backfill_smoothed(Model, chunk_size=5000, engine=None):
+    """run the ingest low-pass over the history of Model"""
+    engine = engine or db.engine
+    ensure_smooth_columns(engine)
+    table = Table(
+        Model.__tablename__, MetaData(),
+        autoload=True, autoload_with=engine
+    )
+    c = table.c
+    fields = Model.smooth_fields
+    epoch = db.unix_epoch(c.creation_time).label('epoch')
+    pending = c[fields[0] + '_smooth'].is_(None)
+    first_id = engine.execute(select([func.min(c.id)]).where(pending)).scalar()
+    if first_id is None:
+        return 0
+
+    # continue from the last smoothed row before the gap
+    smoothers = {field: ExponentialSmoother(cfg.smoothing.tau) for field in fields}
+    before = engine.execute(
+        select([epoch] + [c[field + '_smooth'] for field in fields])
+        .where(and_(c.id < first_id, ~pending))
+        .order_by(c.id.desc()).limit(1)
+    ).first()
+    if before is not None:
+        for field, value in zip(fields, before[1:]):
+            smoothers[field].value, smoothers[field].time = value, float(before[0])
+
+    update = table.update().where(
+        c.id == bindparam('_id')
+    ).values(
+        **{field + '_smooth': bindparam('_' + field) for field in fields}
+    )
+    last_id, done = first_id - 1, 0
+    while True:
+        rows = engine.execute(
+            select([c.id, epoch] + [c[field] for field in fields])
+            .where(and_(pending, c.id > last_id))
+            .order_by(c.id)
+            .limit(chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+
+        ids, times, *values = zip(*rows)
+        times = [float(t) for t in times]
+        smoothed = {
+            field: smooth_series(times, v, smoothers[field]) for field, v in zip(fields, values)
+        }
+        with engine.begin() as conn:
+            conn.execute(update, [
+                dict({'_id': _id}, **{
+                    '_' + field: float(smoothed[field][i]) if isfinite(smoothed[field][i]) else None
+                    for field in fields
+                })
+                for i, _id in enumerate(ids)
+            ])
+        last_id = ids[-1]
+        done += len(rows)
+        print(" +++ smoothed", done, Model.__tablename__, "samples up to id", last_id)
+
+    if not cfg.smoothing.stored:
+        print(" --- smoothing.stored is disabled, enable it to keep the columns up to date")
+    return done
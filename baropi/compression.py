@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+deadband and swinging-door compression of samples before they are stored
+
+a sample is only stored when one of the compressed fields leaves the
+corridor around the last stored sample, or after max_silence seconds.
+the newest sample is held back, so the one before a change is stored
+too and a straight line between stored samples stays within the
+tolerance: once for swinging door, twice for deadband. readout
+interpolates between the stored samples.
+
+samples without a value in a compressed field are always stored and
+start a new corridor.
+"""
+from .config import cfg
+
+__all__ = [
+    'Deadband',
+    'SwingingDoor',
+    'Compressor',
+    'compressed_fields',
+    'make_compressor'
+]
+
+
+class Deadband:
+    """values within tolerance of the last stored value"""
+
+    def __init__(self, tolerance, time, value):
+        self.tolerance = tolerance
+        self.value = value
+
+    def test(self, time, value):
+        """the state after adding value, None if it leaves the corridor"""
+        return () if abs(value - self.value) <= self.tolerance else None
+
+    def update(self, state):
+        pass
+
+
+class SwingingDoor:
+    """values within tolerance of a straight line from the last stored value"""
+
+    def __init__(self, tolerance, time, value):
+        self.tolerance = tolerance
+        self.time = time
+        self.value = value
+        self.upper = float('inf')
+        self.lower = float('-inf')
+
+    def test(self, time, value):
+        """
+        the slopes of lines within tolerance of every sample so far, None
+        if the line to value itself is not one of them, as value is stored
+        as the end of the line when the next sample leaves
+        """
+        dt = time - self.time
+        if dt <= 0:
+            return None
+        if not self.lower <= (value - self.value) / dt <= self.upper:
+            return None
+        upper = min(self.upper, (value + self.tolerance - self.value) / dt)
+        lower = max(self.lower, (value - self.tolerance - self.value) / dt)
+        return upper, lower
+
+    def update(self, state):
+        self.upper, self.lower = state
+
+
+METHODS = {
+    'deadband': Deadband,
+    'swinging_door': SwingingDoor,
+}
+
+
+class Compressor:
+    """decides which samples of one model are stored"""
+
+    def __init__(self, tolerances, Door=SwingingDoor, max_silence=600):
+        """
+        :param tolerances: largest interpolation error per field
+        :param max_silence: seconds after which a sample is stored anyway
+        """
+        self.tolerances = tolerances
+        self.Door = Door
+        self.max_silence = max_silence
+        self.anchor = None
+        self.doors = {}
+        self.held = None
+        self.stored = 0
+        self.dropped = 0
+
+    def values(self, sample):
+        values = {field: getattr(sample, field) for field in self.tolerances}
+        return None if None in values.values() else values
+
+    def start(self, sample, values):
+        self.anchor = sample.timestamp
+        self.doors = {
+            field: self.Door(tolerance, self.anchor, values[field])
+            for field, tolerance in self.tolerances.items()
+        }
+
+    def fits(self, sample, values):
+        """update the doors and return True when sample can be dropped"""
+        time = sample.timestamp
+        if time - self.anchor >= self.max_silence:
+            return False
+        states = {}
+        for field, door in self.doors.items():
+            states[field] = door.test(time, values[field])
+            if states[field] is None:
+                return False
+        for field, state in states.items():
+            self.doors[field].update(state)
+        return True
+
+    def add(self, sample):
+        """the samples to store now, sample itself may be held back"""
+        values = self.values(sample)
+        if values is None:
+            out = [s for s in (self.held, sample) if s is not None]
+            self.anchor, self.held = None, None
+        elif self.anchor is None:
+            out = [sample]
+            self.start(sample, values)
+        elif self.fits(sample, values):
+            out = []
+            if self.held is not None:
+                self.dropped += 1
+            self.held = sample
+        elif self.held is None:
+            out = [sample]
+            self.start(sample, values)
+        else:
+            # the corridor starts over at the sample before the change
+            out = [self.held]
+            self.start(self.held, self.values(self.held))
+            self.held = None
+            if self.fits(sample, values):
+                self.held = sample
+            else:
+                out.append(sample)
+                self.start(sample, values)
+        self.stored += len(out)
+        return out
+
+    def flush(self):
+        """the held back sample, e.g. on shutdown"""
+        held, self.held, self.anchor = self.held, None, None
+        if held is None:
+            return []
+        self.stored += 1
+        return [held]
+
+
+def compressed_fields(Model):
+    """tolerance per compressed field of Model, empty when it is stored as it comes"""
+    if cfg.compression.method not in METHODS:
+        return {}
+    tolerances = getattr(cfg.compression.tolerance, Model.__tablename__, None)
+    return dict(vars(tolerances)) if tolerances is not None else {}
+
+
+def make_compressor(Model):
+    """a Compressor for Model as configured, None without compression"""
+    tolerances = compressed_fields(Model)
+    if not tolerances:
+        return None
+    return Compressor(tolerances, METHODS[cfg.compression.method], cfg.compression.max_silence)
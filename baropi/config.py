@@ -11,6 +11,8 @@ import yaml
 paranoid = False
 __home__ = '%s/baropi' % environ['HOME']
 __dbfile__ = '%s/klima.db' % __home__
+__spool__ = '%s/spool.bin' % __home__
+__ingest_socket__ = '%s/ingest.sock' % __home__
 
 default = """---
 server:                                         # informs the flask-app about interface and port to bind to
@@ -26,6 +28,75 @@ db:                                             # connection info on the sql ser
         pw: g25v09e85                               # the password of the user
         host: 192.168.0.254                         # the interface the sql server is listening
         port: 3306                                  # port of the sql server
+    store_derived: no                           # persist dew point, abs. humidity and steam pressure on ingest
+                                                # run bin/baropi-backfill to fill existing history
+    rollups: no                                 # maintain minute/hour/day aggregates for long graph windows
+                                                # run bin/baropi-rollups once after enabling to add the history
+    batch_size: 50                              # samples of all sensors written together in one transaction
+    batch_latency: 2                            # seconds a sample waits at most before it is written
+    spool: %s                                   # local file for samples while the db is away, empty disables
+    spool_fsync: 5                              # seconds between fsyncs of the spool
+
+graph:
+    points: 2000                                # longer windows are reduced to this many time buckets by the db
+    plot_points: 1000                           # point budget per plotted series, 0 plots every sample
+    downsampler: lttb                           # lttb or minmax envelope
+    smooth_window: 900                          # seconds averaged by the smoothed lines
+    cache_size: 32                              # rendered graphs kept until a newer sample arrives
+    render_workers: 2                           # processes rendering graphs, 0 renders in the request thread
+    render_queue: 4                             # renders waiting for a worker before requests get a 503
+    render_timeout: 30                          # seconds until a waiting request gets a 504
+
+smoothing:
+    stored: no                                  # low-pass every series on ingest into <field>_smooth columns
+    tau: 300                                    # time constant of the low-pass in seconds
+
+reads:                                          # for every sensor, a sensor entry below can override each key
+    timeout: 8                                  # seconds until a read is given up and counts as a missed sample
+    retries: 3                                  # further attempts after a failed DHT22 read
+    retry_delay: 2                              # seconds before the first retry, the DHT22 needs 2 between reads
+    backoff: 1.5                                # factor on the delay of every further retry
+    record_missed: yes                          # write missed reads and their reason to the missed_reads table
+
+sentinel:
+    thermal: [thermal_zone0]                    # zones in /sys/class/thermal, the first is 'temperature', the others go to 'extra'
+    cpufreq: []                                 # policies in /sys/devices/system/cpu/cpufreq, all of them when empty
+    intervals:                                  # seconds between reads of each group, at least the delay of the sensor
+        temperature: 0                          # temperature and the other thermal zones
+        freq: 0                                 # current cpu frequency
+        memory: 30                              # all ram values
+        disk: 600                               # disk usage of /
+        limits: 3600                            # cpu frequency limits
+    carry: yes                                  # store the last values of groups not read, no leaves them empty
+
+compression:
+    method: none                                # swinging_door or deadband drop samples readers can interpolate, none stores all
+    max_silence: 600                            # seconds after which a sample is stored anyway
+    step: 10                                    # seconds between interpolated values, the delay of the sensor
+    tolerance:                                  # largest interpolation error per field and table, deadband doubles it
+        climate:
+            temperature: 0.1
+            humidity: 0.5
+
+adaptive:                                       # read faster while readings change, a sensor entry can override each key
+    enabled: no                                 # no reads every sensor at its fixed delay
+    min_delay: 2                                # seconds between reads while a field changes fast, the DHT22 needs 2
+    max_delay: 60                               # seconds between reads of stable readings
+    window: 60                                  # seconds of samples in the rate of change
+    relax: 1.5                                  # factor on the delay after every stable sample
+    rates:                                      # change per minute that counts as fast, per table and field
+        climate:
+            temperature: 0.5
+            humidity: 2
+        sentinel:
+            temperature: 5
+
+ingest:
+    socket: %s                                  # unix socket where the gatherer serves its ingest metrics, empty disables
+    dump: 0                                     # seconds between metric summaries in the gatherer log, 0 disables
+
+psychrometrics:
+    engine: exact                               # exact magnus formulas or 'table' for the precomputed DHT22 lookup
 
 redis:                                          # we use redis for not wearing sd cards of raspberry-pi
     enabled: no                                 # we really use redis now?
@@ -48,7 +119,7 @@ sensors:
     #- {module: EmailEventSensor, pin: false, delay: 100}
 
  
-""" % (__dbfile__,)
+""" % (__dbfile__, __spool__, __ingest_socket__)
 
 user_conf_path = "%s/baropi.yml" % __home__
 
@@ -75,6 +146,16 @@ def recreate_cfg():
         default_cfg.write(default)
 
 
+def merge_defaults(data, defaults):
+    """fill keys missing in an older user config from the default config"""
+    for k, v in defaults.items():
+        if k not in data:
+            data[k] = v
+        elif isinstance(v, dict) and isinstance(data[k], dict):
+            merge_defaults(data[k], v)
+    return data
+
+
 def start_up():
     if not exists(__home__):
         mkdir(__home__)
@@ -83,7 +164,10 @@ def start_up():
         recreate_cfg()
         chmod(user_conf_path, 0o600)
 
-    return load_cfg(user_conf_path)
+    return merge_defaults(
+        load_cfg(user_conf_path),
+        yaml.safe_load(default)
+    )
 
 
 class Config:
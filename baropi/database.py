@@ -1,5 +1,9 @@
-from sqlalchemy import create_engine
+from calendar import timegm
+from sqlalchemy import create_engine, literal, select, Float, Integer
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.orm import scoped_session, sessionmaker
 from baropi.config import cfg
 
@@ -22,6 +26,90 @@ def init_db():
     from . import models as m
     print(" +++ registering models", m)
     Base.metadata.create_all(bind=engine) # shit
+    if cfg.db.store_derived:
+        from .backfill import ensure_derived_columns
+        ensure_derived_columns(engine)
+    if cfg.smoothing.stored:
+        from .backfill import ensure_smooth_columns
+        ensure_smooth_columns(engine)
+
+
+class unix_epoch(FunctionElement):
+    """seconds since the epoch of a TIMESTAMP column, rendered per dialect"""
+    type = Float()
+    name = 'unix_epoch'
+
+
+@compiles(unix_epoch)
+def compile_unix_epoch(element, compiler, **kw):
+    return "UNIX_TIMESTAMP(" + compiler.process(element.clauses, **kw) + ")"
+
+
+@compiles(unix_epoch, 'sqlite')
+def compile_unix_epoch_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%s', " + compiler.process(element.clauses, **kw) + ") AS INTEGER)"
+
+
+@compiles(unix_epoch, 'postgresql')
+def compile_unix_epoch_postgresql(element, compiler, **kw):
+    return "EXTRACT(EPOCH FROM " + compiler.process(element.clauses, **kw) + ")"
+
+
+class time_bucket(FunctionElement):
+    """
+    integer bucket number of a TIMESTAMP column for buckets of width seconds
+
+    the width is rendered inline, so GROUP BY and ORDER BY stay identical
+    """
+    type = Integer()
+    name = 'time_bucket'
+
+
+def bucket_args(element, compiler, **kw):
+    column, width = element.clauses
+    return compiler.process(column, **kw), compiler.process(width, **dict(kw, literal_binds=True))
+
+
+@compiles(time_bucket)
+def compile_time_bucket(element, compiler, **kw):
+    return "UNIX_TIMESTAMP({}) DIV {}".format(*bucket_args(element, compiler, **kw))
+
+
+@compiles(time_bucket, 'sqlite')
+def compile_time_bucket_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%s', {}) AS INTEGER) / {}".format(*bucket_args(element, compiler, **kw))
+
+
+@compiles(time_bucket, 'postgresql')
+def compile_time_bucket_postgresql(element, compiler, **kw):
+    return "FLOOR(EXTRACT(EPOCH FROM {}) / {})".format(*bucket_args(element, compiler, **kw))
+
+
+class EpochClock:
+    """
+    datetimes to epoch seconds exactly as unix_epoch() computes them in the database
+
+    the database may apply its own time zone. its offset is asked once per
+    hour of the datetimes, and the last one is kept while the database
+    is away.
+    """
+
+    def __init__(self, bind=None):
+        self.bind = bind
+        self.hour = None
+        self.offset = None
+
+    def __call__(self, when):
+        hour = when.replace(minute=0, second=0, microsecond=0)
+        if hour != self.hour:
+            try:
+                with (self.bind or engine).connect() as c:
+                    epoch = c.execute(select([unix_epoch(literal(hour)).label('epoch')])).scalar()
+                self.hour, self.offset = hour, float(epoch) - timegm(hour.timetuple())
+            except SQLAlchemyError:
+                if self.offset is None:
+                    raise
+        return timegm(when.timetuple()) + when.microsecond / 1e6 + self.offset
 
 
 def format_conn_str(cfg):
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+point budget downsampling of plotted series
+
+lttb and minmax return sorted indices into x and y, so every column of a
+series can be reduced the same way. envelope merges min/max bands of
+bucketed series.
+"""
+import numpy as np
+
+__all__ = [
+    'lttb',
+    'minmax',
+    'envelope',
+    'downsample'
+]
+
+
+def lttb(x, y, n):
+    """
+    indices of n points chosen by largest-triangle-three-buckets
+
+    the triangle of each bucket depends on the point chosen in the previous
+    one, so buckets are walked in order, each of them evaluated vectorized.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    # first and last point are kept, the rest is split into n - 2 buckets
+    edges = np.linspace(1, size - 1, n - 1).astype(np.intp)
+    counts = np.diff(edges)
+    next_x = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])[1:]
+    next_y = np.append(np.add.reduceat(y[:-1], edges[:-1]) / counts, y[-1])[1:]
+
+    out = np.empty(n, dtype=np.intp)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs(
+            (ax - next_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[i] - ay)
+        )
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax(x, y, n):
+    """indices of the minimum and maximum of y in n / 2 equally sized buckets"""
+    y = np.asarray(y, dtype=np.float64)
+    size = len(y)
+    if n >= size or n < 2:
+        return np.arange(size)
+
+    buckets = n // 2
+    width = -(-size // buckets)
+    rows = np.pad(y, (0, buckets * width - size), mode='edge').reshape(buckets, width)
+    start = np.arange(buckets) * width
+    picked = np.concatenate([start + rows.argmin(axis=1), start + rows.argmax(axis=1)])
+    return np.unique(np.minimum(picked, size - 1))
+
+
+def envelope(x, low, high, n):
+    """
+    a min/max band merged into at most n buckets
+
+    :return: mean x, lowest low and highest high of every bucket
+    """
+    size = len(x)
+    if not n or n >= size:
+        return x, low, high
+
+    width = -(-size // n)
+    pad = (0, (-size) % width)
+
+    def rows(a):
+        return np.pad(np.asarray(a, dtype=np.float64), pad, mode='edge').reshape(-1, width)
+
+    return rows(x).mean(axis=1), rows(low).min(axis=1), rows(high).max(axis=1)
+
+
+methods = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+
+def downsample(x, y, n, method='lttb'):
+    """x and y reduced to at most n points, unchanged for n of 0 or None"""
+    if not n:
+        return x, y
+    picked = methods[method](x, y, n)
+    return np.asarray(x)[picked], np.asarray(y)[picked]
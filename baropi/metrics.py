@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+in-process histograms and counters of the ingest pipeline
+
+every sensor gets histograms of its read latency, read retries, schedule
+lag and the time from read until the sample was written, plus counters
+of failed reads, missed deadlines and failed writes. recording is a
+bisect and an increment under a lock, so it can stay on all the time.
+"""
+import json
+from bisect import bisect_left
+from threading import Lock
+
+__all__ = [
+    'Histogram',
+    'Metrics',
+    'metrics'
+]
+
+
+def log_bounds(low, high, per_decade=6):
+    """bucket upper bounds from low to high, equally spaced in log scale"""
+    bounds, i = [], 0
+    while True:
+        bound = low * 10 ** (i / per_decade)
+        bounds.append(float('{:.3g}'.format(bound)))
+        if bound >= high:
+            return bounds
+        i += 1
+
+
+SECONDS = log_bounds(1e-4, 100)
+RETRIES = [0, 1, 2, 3, 5, 10, 15, 20, 30]
+
+
+class Histogram:
+    """counts per bucket, values above the last bound land in an overflow bucket"""
+
+    def __init__(self, bounds=SECONDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+        self.lock = Lock()
+
+    def record(self, value):
+        i = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q quantile, at most the maximum"""
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.quantile(.5),
+                'p90': self.quantile(.9),
+                'p99': self.quantile(.99),
+                'buckets': [
+                    [bound, n] for bound, n in zip(self.bounds + [None], self.counts) if n
+                ],
+            }
+
+
+class Metrics:
+    """histograms and counters per source, e.g. per sensor"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = Lock()
+
+    def histogram(self, source, name, bounds=SECONDS):
+        key = source, name
+        if key not in self.histograms:
+            with self.lock:
+                self.histograms.setdefault(key, Histogram(bounds))
+        return self.histograms[key]
+
+    def record(self, source, name, value, bounds=SECONDS):
+        self.histogram(source, name, bounds).record(value)
+
+    def count(self, source, name, n=1):
+        with self.lock:
+            self.counters[source, name] = self.counters.get((source, name), 0) + n
+
+    def snapshot(self):
+        out = {}
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        for (source, name), histogram in histograms:
+            out.setdefault(source, {})[name] = histogram.snapshot()
+        for (source, name), n in counters:
+            out.setdefault(source, {})[name] = n
+        return out
+
+    def dumps(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def summary(self):
+        """one line per source with the medians and counters"""
+        lines = []
+        for source, values in sorted(self.snapshot().items()):
+            parts = []
+            for name, value in sorted(values.items()):
+                if isinstance(value, dict):
+                    parts.append("{} p50 {} p99 {} n {}".format(name, value['p50'], value['p99'], value['count']))
+                else:
+                    parts.append("{} {}".format(name, value))
+            lines.append("{}: {}".format(source, ", ".join(parts)))
+        return lines
+
+
+# the ingest metrics of this process
+metrics = Metrics()
@@ -1,18 +1,30 @@
 from sqlalchemy import Column, Integer, Float, String, TIMESTAMP, func, TIME
+from math import isfinite
 from .database import Base
-from fractions import Fraction
-from math import log10
-import matplotlib.dates as mdates
+from .config import cfg
+from . import psychrometrics as pm
 
 
 __all__ = [
     'ClimateSample',
-    'SentinelSample'
+    'SentinelSample',
+    'MissedRead'
 ]
 
+ROLLUP_RESOLUTIONS = (
+    ('minute', 60),
+    ('hour', 60 * 60),
+    ('day', 24 * 60 * 60),
+)
+
 
 class DataModel:
     export_fields = ()
+    rollup_fields = ()
+    rollups = ()
+    smooth_fields = ()
+    # the columns that tell two samples apart, a sample with the same is a duplicate
+    unique_fields = ('creation_time',)
 
     def __init__(self, *args, **kwargs):
         for k, v in kwargs.items():
@@ -21,6 +33,8 @@ class DataModel:
     @property
     def mdate(self):
         try:
+            # matplotlib only for the graphs, not in the gatherer
+            import matplotlib.dates as mdates
             return mdates.date2num(self.timestamp)
         except AttributeError as ae:
             return None
@@ -36,6 +50,10 @@ class DataModel:
             field: getattr(self, field) for field in self.fields_of_interest
         }
 
+    @property
+    def key(self):
+        return tuple(getattr(self, field) for field in self.unique_fields)
+
     @property
     def timestamp(self):
         try:
@@ -43,6 +61,10 @@ class DataModel:
         except AttributeError as ae:
             return None
 
+    def fill_derived(self):
+        """hook to store computed values before the sample is written"""
+        pass
+
 
 class SentinelSample(Base, DataModel):
     __tablename__ = 'sentinel'
@@ -72,6 +94,20 @@ class SentinelSample(Base, DataModel):
         unique=True
     )
 
+    smooth_fields = ("temperature",)
+
+    if cfg.smoothing.stored:
+        temperature_smooth = Column(Float)
+
+    rollup_fields = (
+        "temperature",
+        "percent_ram",
+        "used_ram",
+        "avail_ram",
+        "freq_current",
+        "disk_used"
+    )
+
     def __repr__(self):
         return "SentinelSample({})".format(self.timestamp)
 
@@ -89,21 +125,31 @@ class ClimateSample(Base, DataModel):
     )
     extra = Column(String(1024), server_default="")
 
-    __T_lteq_0 = Fraction(7.5), Fraction(237.3)
-    __T_gt_0_thaw = Fraction(7.6), Fraction(240.7)
-    __T_gt_0_freeze = Fraction(9.5), Fraction(265.5)
-    __gas_constant = Fraction(8314.3)
-    __molecular_weight_steam = Fraction(18.016)
+    rollup_fields = ("temperature", "humidity")
+    smooth_fields = ("temperature", "humidity")
 
-    export_fields = (
-        "mdate", "t_Kelvin",
+    if cfg.smoothing.stored:
+        # low-pass of the readings, written by the gatherer
+        temperature_smooth = Column(Float)
+        humidity_smooth = Column(Float)
+
+    derived_fields = (
         "moisture_gpm3",
         "dew_point_celsius",
         "steampressure_saturated_hPa",
         "steam_pressure_hPa"
-
     )
 
+    if cfg.db.store_derived:
+        # filled by fill_derived() on ingest and by bin/baropi-backfill,
+        # the properties below prefer these over computing the values
+        stored_moisture_gpm3 = Column('moisture_gpm3', Float)
+        stored_dew_point_celsius = Column('dew_point_celsius', Float)
+        stored_steampressure_saturated_hPa = Column('steampressure_saturated_hPa', Float)
+        stored_steam_pressure_hPa = Column('steam_pressure_hPa', Float)
+
+    export_fields = ("mdate", "t_Kelvin") + derived_fields
+
     def __init__(self, *args, **kwargs):
         DataModel.__init__(self, *args, **kwargs)
 
@@ -128,15 +174,15 @@ class ClimateSample(Base, DataModel):
     @property
     def mdate(self):
         try:
+            # matplotlib only for the graphs, not in the gatherer
+            import matplotlib.dates as mdates
             return mdates.date2num(self.timestamp)
         except AttributeError as ae:
             return None
 
     def choose_ab(self):
-        if self.t_Celsius <= 0:
-            return self.__T_lteq_0
-        elif self.t_Celsius > 0:
-            return self.__T_gt_0_thaw
+        a, b = pm.choose_ab(self.t_Celsius)
+        return float(a), float(b)
 
     @property
     def a(self):
@@ -152,7 +198,7 @@ class ClimateSample(Base, DataModel):
 
     @property
     def t_Kelvin(self):
-        return self.t_Celsius + Fraction(273.15)
+        return self.derived['t_Kelvin']
 
     @property
     def r_percent(self):
@@ -165,34 +211,62 @@ class ClimateSample(Base, DataModel):
     def r_computed(self):
         return 100 * self.steampressure_saturated_hPa / self.steampressure_saturated_hPa
 
+    @property
+    def derived(self):
+        """all computed values of this sample, recomputed when the readings change"""
+        key = self.t_Celsius, self.r_percent
+        cached = getattr(self, '_derived', None)
+        if cached is None or cached[0] != key:
+            cached = self._derived = key, pm.derive_one(*key)
+        return cached[1]
+
+    def stored_or_computed(self, field):
+        stored = getattr(self, "stored_" + field, None)
+        if stored is not None:
+            return stored
+        return self.derived[field]
+
+    def fill_derived(self):
+        if not cfg.db.store_derived:
+            return
+        for field in self.derived_fields:
+            value = self.derived[field]
+            setattr(self, "stored_" + field, value if isfinite(value) else None)
+
     @property
     def moisture_gpm3(self):
         """absolute air moisture in g/m³"""
-        return 10 ** 5 * self.__molecular_weight_steam / self.__gas_constant * self.steam_pressure_hPa / self.t_Kelvin
+        return self.stored_or_computed("moisture_gpm3")
 
     @property
     def steampressure_saturated_hPa(self):
-        return Fraction(6.1078) * 10 ** Fraction((self.a * self.t_Celsius) / (self.b + self.t_Celsius))
+        return self.stored_or_computed("steampressure_saturated_hPa")
 
     @property
     def steam_pressure_hPa(self):
-        return Fraction(
-            self.r_percent / 100
-        ) * self.steampressure_saturated_hPa
+        return self.stored_or_computed("steam_pressure_hPa")
 
     @property
     def dew_point_celsius(self):
-        def v():
-            try:
-                return Fraction(
-                    log10(
-                        self.steam_pressure_hPa / 6.1078
-                    )
-                )
-            except ValueError as ve:
-                return float("-inf")
+        return self.stored_or_computed("dew_point_celsius")
+
+
+class MissedRead(Base, DataModel):
+    """a read of a sensor that gave no sample, and why"""
+    __tablename__ = 'missed_reads'
+    # sensors share their timetables, so misses of the same second are routine
+    unique_fields = ('sensor', 'creation_time')
+    id = Column(Integer, primary_key=True)
+    sensor = Column(String(64), nullable=False)
+    reason = Column(String(1024), server_default="")
+    creation_time = Column(
+        TIMESTAMP,
+        server_default=func.now(),
+        nullable=False
+    )
 
-        return float(self.b * v() / (self.a - v()))
+    def __repr__(self):
+        return "MissedRead({}, {})".format(self.sensor, self.timestamp)
 
 
 class EventRequest(Base, DataModel):
@@ -227,4 +301,34 @@ class EventRequest(Base, DataModel):
 
     @property
     def end(self):
-        return self.end_time.timestamp()
\ No newline at end of file
+        return self.end_time.timestamp()
+
+
+def rollup_model(Model, name, width):
+    """
+    aggregate table of Model for buckets of width seconds
+
+    every rollup field gets count, min, max, sum and sum of squares, so
+    buckets can be merged into coarser ones and mean and stddev derived.
+    """
+    attrs = {
+        '__tablename__': '{}_{}'.format(Model.__tablename__, name),
+        'sample_model': Model,
+        'width': width,
+        'id': Column(Integer, primary_key=True),
+        'start': Column(Integer, nullable=False, unique=True),
+        '__repr__': lambda self: "{}({})".format(self.__class__.__name__, self.start),
+    }
+    for field in Model.rollup_fields:
+        attrs[field + '_count'] = Column(Integer, nullable=False, server_default='0')
+        attrs[field + '_min'] = Column(Float)
+        attrs[field + '_max'] = Column(Float)
+        attrs[field + '_sum'] = Column(Float, nullable=False, server_default='0')
+        attrs[field + '_sqsum'] = Column(Float, nullable=False, server_default='0')
+    return type(Model.__name__ + name.capitalize(), (Base, DataModel), attrs)
+
+
+for _Model in (ClimateSample, SentinelSample):
+    _Model.rollups = tuple(
+        rollup_model(_Model, name, width) for name, width in ROLLUP_RESOLUTIONS
+    )
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+vectorized magnus formulas for the derived values of a ClimateSample
+
+every function accepts scalars or array-likes of temperature (°C) and
+relative humidity (%) and returns float64 numpy values. ClimateSample
+goes through derive_one() for a single sample, so per object and batch
+results are identical. psychrometrics.engine in the config selects the
+exact formulas or the precomputed MagnusTable.
+
+see testing/moullier.py for the formulas and the original Fraction based
+reference implementation.
+"""
+from functools import lru_cache
+import numpy as np
+from .config import cfg
+
+__all__ = [
+    'MAGNUS_LTEQ_0',
+    'MAGNUS_GT_0_THAW',
+    'MAGNUS_GT_0_FREEZE',
+    'choose_ab',
+    't_kelvin',
+    'steampressure_saturated_hPa',
+    'steam_pressure_hPa',
+    'moisture_gpm3',
+    'dew_point_celsius',
+    'derive_exact',
+    'MagnusTable',
+    'magnus_table',
+    'derive',
+    'derive_one',
+]
+
+MAGNUS_LTEQ_0 = 7.5, 237.3
+MAGNUS_GT_0_THAW = 7.6, 240.7
+MAGNUS_GT_0_FREEZE = 9.5, 265.5
+MAGNUS_BASE_HPA = 6.1078
+KELVIN_OFFSET = 273.15
+GAS_CONSTANT = 8314.3  # J/(kmol*K)
+MOLECULAR_WEIGHT_STEAM = 18.016  # kg/kmol
+MOISTURE_FACTOR = 10 ** 5 * MOLECULAR_WEIGHT_STEAM / GAS_CONSTANT
+
+
+def _as_float(x):
+    return np.asarray(x, dtype=np.float64)
+
+
+def choose_ab(t_celsius):
+    """magnus parameters a, b per temperature, same branches as ClimateSample.choose_ab"""
+    below = _as_float(t_celsius) <= 0
+    a = np.where(below, MAGNUS_LTEQ_0[0], MAGNUS_GT_0_THAW[0])
+    b = np.where(below, MAGNUS_LTEQ_0[1], MAGNUS_GT_0_THAW[1])
+    return a, b
+
+
+def t_kelvin(t_celsius):
+    return _as_float(t_celsius) + KELVIN_OFFSET
+
+
+def _saturated(t, a, b):
+    return MAGNUS_BASE_HPA * 10 ** (a * t / (b + t))
+
+
+def _steam(r, sdd):
+    return r / 100 * sdd
+
+
+def _moisture(dd, tk):
+    return MOISTURE_FACTOR * dd / tk
+
+
+def _dew_point(dd, a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.log10(dd / MAGNUS_BASE_HPA)
+        return b * v / (a - v)
+
+
+def steampressure_saturated_hPa(t_celsius):
+    t = _as_float(t_celsius)
+    a, b = choose_ab(t)
+    return _saturated(t, a, b)
+
+
+def steam_pressure_hPa(t_celsius, r_percent):
+    return _steam(_as_float(r_percent), steampressure_saturated_hPa(t_celsius))
+
+
+def moisture_gpm3(t_celsius, r_percent):
+    """absolute air moisture in g/m³"""
+    return _moisture(steam_pressure_hPa(t_celsius, r_percent), t_kelvin(t_celsius))
+
+
+def dew_point_celsius(t_celsius, r_percent):
+    a, b = choose_ab(t_celsius)
+    return _dew_point(steam_pressure_hPa(t_celsius, r_percent), a, b)
+
+
+def derive_exact(temperature, humidity):
+    """
+    all derived columns in one vectorized pass
+
+    :param temperature: temperatures in °C
+    :param humidity: relative humidities in %
+    :return: dict of float64 arrays, keyed like the ClimateSample properties
+    """
+    t = _as_float(temperature)
+    r = _as_float(humidity)
+    a, b = choose_ab(t)
+    sdd = _saturated(t, a, b)
+    dd = _steam(r, sdd)
+    tk = t_kelvin(t)
+    return {
+        't_Kelvin': tk,
+        'steampressure_saturated_hPa': sdd,
+        'steam_pressure_hPa': dd,
+        'moisture_gpm3': _moisture(dd, tk),
+        'dew_point_celsius': _dew_point(dd, a, b),
+    }
+
+
+class MagnusTable:
+    """
+    precomputed magnus values for the range and resolution of a DHT22
+
+    the dew point only needs log10(dd/6.1078) = log10(r/100) + a*t/(b+t),
+    so one table over temperature and one over humidity cover every
+    (T, RH) pair. quantized readings are plain lookups, anything between
+    grid points is interpolated linearly and readings outside the range
+    fall back to derive_exact().
+    """
+
+    def __init__(self, t_min=-40., t_max=80., step=.1):
+        self.t_min = t_min
+        self.t_max = t_max
+        self.step = step
+        t = t_min + np.arange(round((t_max - t_min) / step) + 1) * step
+        r = np.arange(round(100 / step) + 1) * step
+        a, b = choose_ab(t)
+        self.saturated = _saturated(t, a, b)
+        self.exponent = a * t / (b + t)
+        with np.errstate(divide='ignore'):
+            self.log_rel = np.log10(r / 100)
+
+    def locate(self, x, x_min):
+        """grid index of x, plus the interpolation position for off-grid values"""
+        pos = (x - x_min) / self.step
+        index = np.rint(pos).astype(np.intp)
+        if np.all(np.abs(pos - index) < 1e-6):
+            return index, None
+        return index, pos
+
+    @staticmethod
+    def lookup(table, location):
+        index, pos = location
+        if pos is None:
+            return table[index]
+        lo = np.clip(np.floor(pos), 0, len(table) - 2).astype(np.intp)
+        frac = pos - lo
+        with np.errstate(invalid='ignore'):
+            between = (1 - frac) * table[lo] + frac * table[lo + 1]
+        return np.where(np.abs(pos - index) < 1e-6, table[index], between)
+
+    def derive(self, temperature, humidity):
+        t = _as_float(temperature)
+        r = _as_float(humidity)
+        inside = (t >= self.t_min) & (t <= self.t_max) & (r >= 0) & (r <= 100)
+        if not inside.all():
+            result = derive_exact(t, r)
+            if inside.any():
+                for k, v in self.derive(t[inside], r[inside]).items():
+                    result[k][inside] = v
+            return result
+
+        a, b = choose_ab(t)
+        at_t = self.locate(t, self.t_min)
+        sdd = self.lookup(self.saturated, at_t)
+        dd = _steam(r, sdd)
+        tk = t_kelvin(t)
+        with np.errstate(invalid='ignore'):
+            v = self.lookup(self.log_rel, self.locate(r, 0)) + self.lookup(self.exponent, at_t)
+            dew_point = b * v / (a - v)
+        return {
+            't_Kelvin': tk,
+            'steampressure_saturated_hPa': sdd,
+            'steam_pressure_hPa': dd,
+            'moisture_gpm3': _moisture(dd, tk),
+            'dew_point_celsius': dew_point,
+        }
+
+
+@lru_cache(maxsize=1)
+def magnus_table():
+    return MagnusTable()
+
+
+def derive(temperature, humidity):
+    """derived columns with the engine chosen by psychrometrics.engine in the config"""
+    if cfg.psychrometrics.engine == 'table':
+        return magnus_table().derive(temperature, humidity)
+    return derive_exact(temperature, humidity)
+
+
+def derive_one(temperature, humidity):
+    """
+    derive() for a single sample, as python floats
+
+    numpy may round 0-d values differently than contiguous arrays, so the
+    sample is evaluated as 1-element arrays on the same path as a batch.
+    """
+    return {
+        k: float(v[0]) for k, v in derive(
+            np.atleast_1d(_as_float(temperature)),
+            np.atleast_1d(_as_float(humidity))
+        ).items()
+    }
@@ -1,14 +1,23 @@
 #!/usr/bin/python3
 from os import environ
 import pendulum as p
-import statistics
+import io
 import math
+import threading
+from itertools import chain
 from datetime import datetime, timedelta
 from scipy import signal
 from scipy.signal import butter, filtfilt
-from sqlalchemy import and_
+from sqlalchemy import and_, func, literal, select
+import numpy as np
 from . import database as db
 from . import models as m
+from . import psychrometrics as pm
+from . import rollups
+from .downsample import downsample, envelope
+from .smoothing import moving_average
+from .compression import compressed_fields
+from .config import cfg
 
 import matplotlib
 
@@ -17,7 +26,8 @@ if "DISPLAY" not in environ:
 
 from mpl_toolkits.axes_grid1 import host_subplot
 import mpl_toolkits.axisartist as axis_artist
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.dates as mdates
 
 
@@ -29,18 +39,267 @@ def get_last_samples(_timedelta):
     )
 
 
+def get_last_columns(_timedelta):
+    now = datetime.now()
+    return prepare_columns(
+        now - timedelta(**_timedelta),
+        now
+    )
+
+
+def get_last_series(_timedelta, points=None):
+    now = datetime.now()
+    return prepare_series(
+        now - timedelta(**_timedelta),
+        now,
+        points
+    )
+
+
+def newest_sample_id(model=m.ClimateSample):
+    with db.engine.connect() as conn:
+        return conn.execute(select([func.max(model.id)])).scalar()
+
+
+def newest_sample(model=m.ClimateSample):
+    """id and creation time in epoch seconds of the newest sample, None without samples"""
+    with db.engine.connect() as conn:
+        return conn.execute(
+            select([model.id, db.unix_epoch(model.creation_time).label('epoch')])
+            .order_by(model.id.desc()).limit(1)
+        ).first()
+
+
+def in_window(model, start, end):
+    """samples from start until before end, like the rollup buckets"""
+    return and_(
+        model.creation_time >= start,
+        model.creation_time < end
+    )
+
+
 def prepare_data(start, end):
     return db.db_session.query(m.ClimateSample).filter(
-        and_(
-            m.ClimateSample.timestamp > start,
-            m.ClimateSample.timestamp < end
+        in_window(m.ClimateSample, start, end)
+    ).order_by(m.ClimateSample.creation_time).all()
+
+
+def fetch_columns(conn, query, names, size, chunk_size=4096):
+    """
+    stream the rows of query into one preallocated float64 array
+
+    :return: dict of one column per name
+    """
+    width = len(names)
+    out = np.empty((size, width))
+    n = 0
+    result = conn.execution_options(stream_results=True).execute(query)
+    # plain dbapi tuples, sqlalchemy row proxies are too slow to convert
+    cursor = result.cursor
+    for rows in iter(lambda: cursor.fetchmany(chunk_size), ()):
+        if not rows:
+            break
+        if n + len(rows) > len(out):
+            # samples written between count and select
+            out = np.resize(out, (n + len(rows), width))
+        out[n:n + len(rows)] = np.fromiter(
+            (np.nan if v is None else v for v in chain.from_iterable(rows)),
+            np.float64, len(rows) * width
+        ).reshape(-1, width)
+        n += len(rows)
+    result.close()
+
+    out = out[:n]
+    return {name: out[:, i] for i, name in enumerate(names)}
+
+
+def count_samples(conn, model, window):
+    return conn.execute(
+        select([func.count(model.id)]).where(window)
+    ).scalar()
+
+
+def smooth_columns(fields, model):
+    """the stored <field>_smooth columns that go along with fields"""
+    if not cfg.smoothing.stored:
+        return ()
+    return tuple(f + '_smooth' for f in fields if f in model.smooth_fields)
+
+
+def reconstruct(columns, step, max_gap):
+    """
+    values of compressed samples every step seconds, interpolated between the stored ones
+
+    the stored samples are kept, so are their peaks. values next to a
+    sample without a value or in a gap longer than max_gap are NaN.
+    """
+    times = columns['time']
+    if len(times) < 2:
+        return columns
+    grid = np.union1d(np.arange(math.ceil(times[0] / step) * step, times[-1], step), times)
+    # the stored samples before and after every grid time
+    before = np.searchsorted(times, grid, side='right') - 1
+    after = np.minimum(before + 1, len(times) - 1)
+    t0, t1 = times[before], times[after]
+    on_sample = grid == t0
+    fraction = np.where(on_sample, 0., (grid - t0) / np.where(t1 > t0, t1 - t0, 1.))
+    gap = (t1 - t0 > max_gap) & ~on_sample
+    out = {'time': grid}
+    for name, column in columns.items():
+        if name == 'time':
+            continue
+        v0, v1 = column[before], column[after]
+        values = np.where(on_sample, v0, v0 + (v1 - v0) * fraction)
+        values[gap] = np.nan
+        out[name] = values
+    return out
+
+
+def prepare_columns(start, end, fields=("temperature", "humidity"), model=m.ClimateSample, chunk_size=4096,
+                    step=None):
+    """
+    samples between start and end as numpy columns instead of ORM objects
+
+    only the needed columns are selected and streamed with a server-side
+    cursor into one preallocated array. compressed samples are
+    interpolated every step seconds, compression.step by default.
+
+    :return: dict with 'time' in epoch seconds and a float64 array per field
+             and per stored <field>_smooth column
+    """
+    compressed = bool(compressed_fields(model))
+    if compressed:
+        # the stored samples around the edges of the window, for interpolation
+        silence = timedelta(seconds=cfg.compression.max_silence)
+        window = in_window(model, start - silence, end + silence)
+    else:
+        window = in_window(model, start, end)
+    fields = tuple(fields) + smooth_columns(fields, model)
+    query = select(
+        [db.unix_epoch(model.creation_time).label('time')] + [getattr(model, f) for f in fields]
+    ).where(window).order_by(model.creation_time)
+
+    with db.engine.connect() as conn:
+        columns = fetch_columns(
+            conn, query, ('time',) + fields,
+            count_samples(conn, model, window), chunk_size
         )
-    ).all()
+        if not compressed:
+            return columns
+        lo, hi = conn.execute(select([
+            db.unix_epoch(literal(start)).label('start'),
+            db.unix_epoch(literal(end)).label('end')
+        ])).first()
+
+    step = step or cfg.compression.step
+    columns = reconstruct(columns, step, cfg.compression.max_silence + 2 * step)
+    inside = (columns['time'] >= lo) & (columns['time'] < hi)
+    return {name: column[inside] for name, column in columns.items()}
+
+
+def bucket_width(start, end, points):
+    """seconds per bucket so that the window fits into points buckets"""
+    return max(1, int(math.ceil((end - start).total_seconds() / points)))
+
+
+def prepare_buckets(start, end, points, fields=("temperature", "humidity"), model=m.ClimateSample):
+    """
+    samples between start and end reduced by the database to time buckets
+
+    :return: dict with the mean 'time' of each bucket, the sample 'count'
+             and min, mean and max per field as <field>_min, <field>, <field>_max,
+             plus the mean of the stored <field>_smooth columns
+    """
+    window = in_window(model, start, end)
+    bucket = db.time_bucket(model.creation_time, bucket_width(start, end, points))
+    names = ['time', 'count']
+    selected = [func.avg(db.unix_epoch(model.creation_time)), func.count(model.id)]
+    for field in fields:
+        column = getattr(model, field)
+        names += [field + '_min', field, field + '_max']
+        selected += [func.min(column), func.avg(column), func.max(column)]
+    for name in smooth_columns(fields, model):
+        names.append(name)
+        selected.append(func.avg(getattr(model, name)))
+
+    query = select(
+        [s.label(n) for s, n in zip(selected, names)]
+    ).where(window).group_by(bucket).order_by(bucket)
+
+    with db.engine.connect() as conn:
+        return fetch_columns(conn, query, names, points + 1)
+
+
+def bucket_columns(columns, width, fields):
+    """prepare_buckets() done by numpy on columns"""
+    times = columns['time']
+    if not len(times):
+        return dict(columns, count=times)
+    keys = np.floor(times / width)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    counts = np.diff(np.append(starts, len(times)))
+
+    def mean(column):
+        finite = np.isfinite(column)
+        n = np.add.reduceat(finite, starts)
+        total = np.add.reduceat(np.where(finite, column, 0.), starts)
+        return np.where(n > 0, total / np.maximum(n, 1), np.nan)
+
+    out = {'time': np.add.reduceat(times, starts) / counts, 'count': counts.astype(np.float64)}
+    with np.errstate(invalid='ignore'):
+        for field in fields:
+            out[field + '_min'] = np.fmin.reduceat(columns[field], starts)
+            out[field] = mean(columns[field])
+            out[field + '_max'] = np.fmax.reduceat(columns[field], starts)
+    for name in columns:
+        if name.endswith('_smooth'):
+            out[name] = mean(columns[name])
+    return out
+
+
+def prepare_rollup_buckets(rollup, start, end, points, fields=("temperature", "humidity")):
+    """prepare_buckets() served from the pre-aggregated rollup tables"""
+    query, names = rollups.bucket_query(
+        rollup, start, end, bucket_width(start, end, points), fields
+    )
+    with db.engine.connect() as conn:
+        return fetch_columns(conn, query, names, points + 1)
+
+
+def prepare_series(start, end, points=None, fields=("temperature", "humidity"), model=m.ClimateSample):
+    """
+    raw columns, or time buckets when the window holds more than points samples
+
+    buckets come from the coarsest rollup that fits when db.rollups is enabled.
+    compressed samples are interpolated and then bucketed by numpy, the
+    database only holds the samples at the changes.
+    """
+    if points and compressed_fields(model):
+        width = bucket_width(start, end, points)
+        # still a few values per bucket, the stored samples keep the peaks
+        columns = prepare_columns(start, end, fields, model, step=max(cfg.compression.step, width / 10.))
+        return bucket_columns(columns, width, fields) if len(columns['time']) > points else columns
+    if points:
+        rollup = cfg.db.rollups and rollups.choose_rollup(
+            model, bucket_width(start, end, points)
+        )
+        if rollup:
+            return prepare_rollup_buckets(rollup, start, end, points, fields)
+        with db.engine.connect() as conn:
+            size = count_samples(conn, model, in_window(model, start, end))
+        if size > points:
+            return prepare_buckets(start, end, points, fields, model)
+    return prepare_columns(start, end, fields, model)
+
+
+def epoch2mdate(epoch):
+    """epoch seconds to matplotlib date numbers, whatever epoch matplotlib uses"""
+    return np.asarray(epoch) / 86400. + mdates.date2num(datetime(1970, 1, 1))
 
 
 def hann_smooth(data, window_size=200):
-    win = signal.hann(window_size)
-    filtered = signal.convolve(data, win, mode='same') / sum(win)
+    win = signal.get_window('hann', window_size, fftbins=False)
+    filtered = signal.fftconvolve(data, win, mode='same') / sum(win)
     return filtered
 
 
@@ -69,61 +328,180 @@ def create_graph_data(data, prop):
     return [getattr(d, prop) for d in data]
 
 
-def plot(samples, averaging=360):
-    if samples:
-        plt.figure(figsize=(8, 6), dpi=100)
-        fig, ax1, ax2, ax3, ax4 = prepare_chart()
-        window = nearest_odd(len(samples) * 25 / 1000)
-        times = [s.mdate for s in samples]
-        graphs = [
-            (ax1, create_graph_data(samples, "t_Celsius"), 'r_percent', window, "temp"),
-            (ax2, create_graph_data(samples, "r_percent"), 'g', window, "humidity rel."),
-            (ax3, create_graph_data(samples, "moisture_gpm3"), 'b', window, "humidity abs."),
-            (ax4, create_graph_data(samples, "dew_point_celsius"), 'c', window, "dew point"),
-        ]
-
-        for meth in [noop, signal.savgol_filter]:
-            for ax, data, cl, window, label in graphs:
-                ax.axhline(
-                    y=statistics.mean(data),
+def smooth(times, data, weights=None):
+    """moving average over graph.smooth_window seconds, weighted by sample counts"""
+    return moving_average(times, data, cfg.graph.smooth_window, weights)
+
+
+class Chart:
+    """
+    figure, axes and artists of the climate graph, built once per worker
+
+    update() only swaps the data of the artists and rescales the axes.
+    the figure is not registered with pyplot, so nothing leaks between
+    requests.
+    """
+    font = {
+        'font.weight': 'normal',
+        'font.size': 8
+    }
+    series = (
+        # field, color, label, draw raw samples
+        ('temperature', 'r', "temp", True),
+        ('humidity', 'g', "humidity rel.", True),
+        ('moisture_gpm3', 'b', "humidity abs.", False),
+        ('dew_point_celsius', 'c', "dew point", False),
+    )
+
+    def __init__(self):
+        with matplotlib.rc_context(self.font):
+            self.figure = Figure(figsize=(8, 6), dpi=100)
+            FigureCanvasAgg(self.figure)
+            self.axes = prepare_chart(self.figure)
+            self.mean, self.raw, self.smoothed, self.bands = {}, {}, {}, {}
+            for ax, (field, cl, label, raw) in zip(self.axes, self.series):
+                self.mean[field] = ax.axhline(
+                    y=0,
                     ls=":",
                     linewidth=2,
                     color=cl,
-                    alpha=.303125,
-                    label=label
+                    alpha=.303125
                 )
+                if raw:
+                    self.raw[field], = ax.plot([], [], cl + "x", markersize=1, alpha=.103125)
+                self.smoothed[field], = ax.plot(
+                    [], [],
+                    cl, linewidth=1,
+                    alpha=.6903125, label=label)
+            self.axes[0].legend(
+                handles=list(self.smoothed.values()), loc='upper left', fontsize=8
+            )
+            self.figure.autofmt_xdate()
+
+    @staticmethod
+    def derive(temperature, humidity):
+        data = dict(pm.derive(temperature, humidity))
+        data['temperature'] = np.asarray(temperature)
+        data['humidity'] = np.asarray(humidity)
+        return data
+
+    def stored_smooth(self, columns):
+        """the series smoothed by the gatherer, None unless complete"""
+        try:
+            t, rh = columns['temperature_smooth'], columns['humidity_smooth']
+        except KeyError:
+            return None
+        if not (np.isfinite(t).all() and np.isfinite(rh).all()):
+            return None
+        return self.derive(t, rh)
+
+    def update(self, columns, plot_points):
+        def reduce(x, y):
+            return downsample(x, y, plot_points, cfg.graph.downsampler)
+
+        times = epoch2mdate(columns['time'])
+        data = self.derive(columns['temperature'], columns['humidity'])
+        stored = self.stored_smooth(columns)
+        weights = columns.get('count')
+
+        for ax, (field, cl, label, raw) in zip(self.axes, self.series):
+            y = data[field]
+            mean = np.average(y, weights=weights)
+            self.mean[field].set_ydata([mean, mean])
+            if field in self.bands:
+                self.bands.pop(field).remove()
+            band = None
+            if raw and 'count' in columns:
+                self.raw[field].set_data([], [])
+                band = envelope(times, columns[field + '_min'], columns[field + '_max'], plot_points)
+                self.bands[field] = ax.fill_between(*band, color=cl, linewidth=0, alpha=.103125)
+            elif raw:
+                self.raw[field].set_data(*reduce(times, y))
+            smoothed = stored[field] if stored is not None else smooth(columns['time'], y, weights)
+            self.smoothed[field].set_data(*reduce(times, smoothed))
+
+            # relim only knows lines, the band is added by hand
+            ax.relim()
+            if band is not None:
+                ax.update_datalim(np.column_stack([band[0], band[1]]))
+                ax.update_datalim(np.column_stack([band[0], band[2]]))
+            ax.autoscale_view()
+
+        self.axes[0].set_xlim(times[0], times[-1] if times[-1] > times[0] else times[0] + 1 / 24.)
+        return self.figure
+
+    def render(self, columns, plot_points, format='svg'):
+        with matplotlib.rc_context(self.font):
+            self.update(columns, plot_points)
+            buf = io.BytesIO()
+            self.figure.savefig(
+                buf,
+                pad_inches=0,
+                bbox_inches='tight',
+                dpi=100,
+                format=format
+            )
+            return buf.getvalue()
+
+
+charts = threading.local()
+
+
+def chart():
+    """the chart template of the calling thread"""
+    if not hasattr(charts, 'chart'):
+        charts.chart = Chart()
+    return charts.chart
 
-                if meth == noop:
-                    if ax in [ax1, ax2]:
-                        ax.plot(times, meth(data), cl + "x", markersize=1, alpha=.103125)
-
-                elif meth == signal.savgol_filter:
-                    ax.plot(
-                        times, meth(data, window, 1),
-                        cl, linewidth=1,
-                        alpha=.6903125, label=label)
-                    pass
-
-        plt.gcf().autofmt_xdate()
 
-        return plt, fig
-
-
-def prepare_chart():
-    # fig, ax = plt.subplots()
-    font = {  # 'family': 'normal',
-        'weight': 'normal',
-        'size': 8}
-
-    matplotlib.rc('font', **font)
-
-    host = host_subplot(111, axes_class=axis_artist.Axes)
-    plt.subplots_adjust(right=.75, left=.08, bottom=.05, top=.98)
+def plot(samples, averaging=360):
+    if samples:
+        return plot_columns({
+            'time': np.array([s.timestamp for s in samples], dtype=np.float64),
+            'temperature': create_graph_data(samples, "t_Celsius"),
+            'humidity': create_graph_data(samples, "r_percent"),
+        }, averaging)
+
+
+def with_readings(columns):
+    """columns without the rows that have no readings"""
+    readings = np.isfinite(columns['temperature']) & np.isfinite(columns['humidity'])
+    if readings.all():
+        return columns
+    return {name: np.asarray(column)[readings] for name, column in columns.items()}
+
+
+def plot_columns(columns, averaging=360, plot_points=None):
+    """
+    :param plot_points: point budget per plotted series, graph.plot_points
+                        from the config if None, 0 plots every sample
+    :return: the figure of the chart template of this thread
+    """
+    if plot_points is None:
+        plot_points = cfg.graph.plot_points
+    columns = with_readings(columns)
+    if len(columns['time']):
+        with matplotlib.rc_context(Chart.font):
+            return chart().update(columns, plot_points)
+
+
+def render_graph(columns, plot_points=None, format='svg'):
+    """the graph of columns as image bytes, None without samples"""
+    if plot_points is None:
+        plot_points = cfg.graph.plot_points
+    columns = with_readings(columns)
+    if len(columns['time']):
+        return chart().render(columns, plot_points, format)
+
+
+def prepare_chart(fig):
+    host = host_subplot(111, axes_class=axis_artist.Axes, figure=fig)
+    fig.subplots_adjust(right=.75, left=.08, bottom=.05, top=.98)
 
     # ax1 = host.twinx()
     host.set_xlabel('time')
-    host.set_ylabel('temperature (°C)', color='r_percent')
-    host.tick_params('y', colors='r_percent')
+    host.set_ylabel('temperature (°C)', color='r')
+    host.tick_params('y', colors='r')
 
     ax2 = host.twinx()
     ax2.set_ylabel('rel. humidity (%)', color='g')
@@ -153,15 +531,17 @@ def prepare_chart():
         offset=(80, 0)
     )
 
-    host.legend()
-
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('\n%d.%m\n%H:%M'))
-    #plt.gca().xaxis.set_minor_formatter(mdates.DateFormatter('%H:%M'))
-    plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-    fig = plt.gcf()
+    host.xaxis.set_major_formatter(mdates.DateFormatter('\n%d.%m\n%H:%M'))
+    #host.xaxis.set_minor_formatter(mdates.DateFormatter('%H:%M'))
+    host.xaxis.set_major_locator(mdates.AutoDateLocator())
 
-    return fig, host, ax2, ax3, ax4
+    return host, ax2, ax3, ax4
 
 
 def create_graph(samples):
     return plot(samples)
+
+
+def create_graph_columns(columns, plot_points=None):
+    """columns from prepare_columns or the time buckets of prepare_buckets"""
+    return plot_columns(columns, plot_points=plot_points)
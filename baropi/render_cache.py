@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# coding=utf-8
+from collections import OrderedDict
+from threading import Lock
+
+__all__ = [
+    'RenderCache'
+]
+
+
+class RenderCache:
+    """
+    bounded LRU of rendered graphs
+
+    there is one entry per window, tagged with the id of the newest sample
+    it was rendered with. once the gatherer writes a newer sample the tag
+    no longer matches and the next render replaces the entry.
+    """
+
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, window, newest):
+        with self.lock:
+            entry = self.entries.get(window)
+            if entry is None or entry[0] != newest:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(window)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, window, newest, data):
+        with self.lock:
+            self.entries[window] = newest, data
+            self.entries.move_to_end(window)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+graph rendering in a bounded pool of worker processes
+
+workers receive plain numpy columns and return image bytes, each of them
+keeps its own chart template. requests beyond the queue depth are turned
+away instead of piling up behind a slow render.
+"""
+import atexit
+import concurrent.futures as cf
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+__all__ = [
+    'RenderError',
+    'RenderBusy',
+    'RenderTimeout',
+    'RenderPool'
+]
+
+
+class RenderError(RuntimeError):
+    pass
+
+
+class RenderBusy(RenderError):
+    pass
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+def render_in_worker(columns, plot_points, format):
+    from .readout import render_graph
+    return render_graph(columns, plot_points, format)
+
+
+class RenderPool:
+    def __init__(self, workers=2, max_queue=4, timeout=30):
+        """
+        :param workers: render processes, 0 renders in the calling thread
+        :param max_queue: renders waiting for a worker before RenderBusy
+        :param timeout: seconds to wait for a render before RenderTimeout
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = BoundedSemaphore(workers + max_queue)
+        self.executor = None
+        self.lock = Lock()
+        atexit.register(self.shutdown)
+
+    def pool(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = cf.ProcessPoolExecutor(self.workers)
+            return self.executor
+
+    def reset(self, executor):
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False)
+
+    def render(self, columns, plot_points, format='svg'):
+        if not self.workers:
+            return render_in_worker(columns, plot_points, format)
+
+        if not self.slots.acquire(blocking=False):
+            raise RenderBusy("all render workers busy")
+        executor = self.pool()
+        try:
+            future = executor.submit(render_in_worker, columns, plot_points, format)
+        except BaseException:
+            self.slots.release()
+            raise
+        # the slot is held until the render finishes, even after a timeout
+        future.add_done_callback(lambda f: self.slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except cf.TimeoutError:
+            raise RenderTimeout("render took longer than %ss" % self.timeout)
+        except BrokenProcessPool as bpp:
+            print(" --- render worker died, restarting pool", bpp)
+            self.reset(executor)
+            raise RenderError("render worker died")
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 # coding=utf-8
 
-from flask import g
-from flask_restful import Resource
-from .config import conf
+from flask import g, request, Response
+from flask_restful import Resource, abort
+from werkzeug.http import is_resource_modified
+from hashlib import sha1
+from json import dumps
+from math import isfinite
+from sqlalchemy import inspect, Float
+from .config import conf, cfg
 from . import models as m
+from . import psychrometrics as pm
+from .readout import prepare_series, newest_sample
+from .window_stats import reads_samples, window_stats
 import datetime as dt
 
 # from redisworks import Root
@@ -13,7 +21,11 @@ redis_conf = conf['redis']['connection']
 
 __all__ = [
     "ViewDHT22",
-    "ViewSentinel"
+    "ViewSentinel",
+    "ViewDHT22Series",
+    "ViewSentinelSeries",
+    "ViewDHT22Stats",
+    "ViewSentinelStats"
 ]
 
 
@@ -62,4 +74,202 @@ class ViewSentinel(SampleViewer):
 
     def __init__(self, *args, **kwargs):
         super(ViewSentinel, self).__init__()
-        self.Model = m.SentinelSample
\ No newline at end of file
+        self.Model = m.SentinelSample
+
+
+def json_column(column):
+    return [v if isfinite(v) else None for v in column.tolist()]
+
+
+def number_arg(name, default, type=float):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return type(value)
+    except ValueError:
+        abort(400, message="{} must be a number".format(name))
+
+
+class WindowViewer(Resource):
+    """
+    json about a window of samples, ?start=&end= in epoch seconds, the last
+    day until now by default, and ?fields= comma separated
+
+    ETag and Last-Modified follow the newest sample, so polling clients
+    get a 304 until a new sample arrives.
+    """
+
+    def __init__(self):
+        Resource.__init__(self)
+
+    @property
+    def raw_fields(self):
+        return tuple(
+            prop.key for prop in inspect(self.Model).column_attrs
+            if isinstance(prop.columns[0].type, Float)
+            # smoothed columns come along with their field, stored derived ones are derived
+            and not prop.key.endswith('_smooth') and not prop.key.startswith('stored_')
+        )
+
+    @property
+    def fields(self):
+        return self.Model.rollup_fields
+
+    @property
+    def default_fields(self):
+        return self.fields
+
+    def parse_window(self):
+        end = number_arg('end', dt.datetime.now().timestamp())
+        start = number_arg('start', end - 86400)
+        fields = tuple(request.args.get('fields', ",".join(self.default_fields)).split(","))
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            abort(400, message="unknown fields {}, choose from {}".format(
+                ", ".join(sorted(unknown)), ", ".join(self.fields)))
+        if start >= end:
+            abort(400, message="need start < end")
+        return start, end, fields
+
+    def payload(self, start, end, fields):
+        raise NotImplementedError('you need to override payload() of your WindowViewer')
+
+    def get(self):
+        start, end, fields = self.parse_window()
+        newest = newest_sample(self.Model)
+        etag = "{}-{}".format(
+            newest.id if newest else 0,
+            # the arguments as sent, so windows until now keep their tag
+            sha1(repr(sorted(request.args.items(multi=True))).encode()).hexdigest()[:16]
+        )
+        modified = dt.datetime.utcfromtimestamp(float(newest.epoch)) if newest else None
+
+        response = Response(mimetype='application/json')
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.cache_control.no_cache = True
+        if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+            response.status_code = 304
+            return response
+
+        data = self.payload(dt.datetime.fromtimestamp(start), dt.datetime.fromtimestamp(end), fields)
+        data.update(start=start, end=end)
+        response.set_data(dumps(data, separators=(',', ':')))
+        return response
+
+
+class SeriesViewer(WindowViewer):
+    """
+    a window of samples as columnar json
+
+    ?points= buckets like /graph, 0 for raw samples. raw samples have every
+    float column of the model, buckets only the rollup fields.
+    """
+    path = "series"
+    such_args = "series"
+
+    @property
+    def fields(self):
+        return self.raw_fields + getattr(self.Model, 'derived_fields', ())
+
+    @property
+    def default_fields(self):
+        return self.Model.rollup_fields + getattr(self.Model, 'derived_fields', ())
+
+    def payload(self, start, end, fields):
+        points = number_arg('points', cfg.graph.points, int)
+        if points < 0:
+            abort(400, message="need points >= 0")
+
+        # derived fields come from the temperature and humidity columns
+        derived = [f for f in fields if f in getattr(self.Model, 'derived_fields', ())]
+        if points:
+            unbucketed = [f for f in fields if f not in derived and f not in self.Model.rollup_fields]
+            if unbucketed:
+                abort(400, message="fields {} only with points=0, buckets have {}".format(
+                    ", ".join(unbucketed), ", ".join(self.default_fields)))
+        read = [
+            f for f in self.raw_fields
+            if f in fields or (derived and f in ("temperature", "humidity"))
+        ]
+        hidden = {
+            f + suffix for f in set(read) - set(fields) for suffix in ('', '_min', '_max', '_smooth')
+        }
+        columns = prepare_series(start, end, points, read, self.Model)
+        if derived:
+            columns.update(
+                (f, v) for f, v in pm.derive(columns['temperature'], columns['humidity']).items()
+                if f in derived
+            )
+        return {
+            'points': points,
+            'bucketed': 'count' in columns,
+            'columns': {
+                name: json_column(column) for name, column in columns.items() if name not in hidden
+            },
+        }
+
+
+class StatsViewer(WindowViewer):
+    """
+    count, min, max, mean and stddev per field of a window of samples
+
+    ?percentiles= comma separated, e.g. 5,50,95, read the samples once
+    instead of using aggregates. read samples have every float column of
+    the model, aggregates only the rollup fields.
+    """
+    path = "stats"
+    such_args = "stats"
+
+    @property
+    def fields(self):
+        return self.raw_fields
+
+    @property
+    def default_fields(self):
+        return self.Model.rollup_fields
+
+    def payload(self, start, end, fields):
+        try:
+            percentiles = [float(p) for p in request.args.get('percentiles', '').split(',') if p]
+        except ValueError:
+            abort(400, message="percentiles must be numbers")
+        if not all(0 <= p <= 100 for p in percentiles):
+            abort(400, message="percentiles must be between 0 and 100")
+        if not reads_samples(self.Model, percentiles):
+            unaggregated = [f for f in fields if f not in self.Model.rollup_fields]
+            if unaggregated:
+                abort(400, message="fields {} only with percentiles, aggregates have {}".format(
+                    ", ".join(unaggregated), ", ".join(self.default_fields)))
+        return {
+            'fields': window_stats(self.Model, start, end, fields, percentiles),
+        }
+
+
+class ViewDHT22Series(SeriesViewer):
+
+    def __init__(self, *args, **kwargs):
+        super(ViewDHT22Series, self).__init__()
+        self.Model = m.ClimateSample
+
+
+class ViewSentinelSeries(SeriesViewer):
+
+    def __init__(self, *args, **kwargs):
+        super(ViewSentinelSeries, self).__init__()
+        self.Model = m.SentinelSample
+
+
+class ViewDHT22Stats(StatsViewer):
+
+    def __init__(self, *args, **kwargs):
+        super(ViewDHT22Stats, self).__init__()
+        self.Model = m.ClimateSample
+
+
+class ViewSentinelStats(StatsViewer):
+
+    def __init__(self, *args, **kwargs):
+        super(ViewSentinelStats, self).__init__()
+        self.Model = m.SentinelSample
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+minute, hour and day aggregates of the sample tables
+
+the gatherer merges every written sample into its buckets with add_samples(),
+rebuild() recreates the aggregates from the raw history. readers pick the
+coarsest resolution that still fits their bucket width with choose_rollup().
+"""
+from math import ceil
+from sqlalchemy import select, func, case, or_, and_, literal
+from . import database as db
+
+__all__ = [
+    'add_samples',
+    'rebuild',
+    'choose_rollup',
+    'bucket_query'
+]
+
+
+def bucket_stats(epochs, samples, fields, width):
+    """count, min, max, sum and sum of squares per bucket start and field"""
+    stats = {}
+    for epoch, sample in zip(epochs, samples):
+        per_field = stats.setdefault(int(epoch) // width * width, {})
+        for field in fields:
+            v = getattr(sample, field)
+            if v is None:
+                continue
+            n, lo, hi, total, sq = per_field.get(field, (0, v, v, 0., 0.))
+            per_field[field] = n + 1, min(lo, v), max(hi, v), total + v, sq + v * v
+    return stats
+
+
+def merge_bucket(conn, Rollup, start, stats):
+    table = Rollup.__table__
+    c = table.c
+    changes, values = {}, {'start': start}
+    for field, (n, lo, hi, total, sq) in stats.items():
+        low, high = c[field + '_min'], c[field + '_max']
+        changes.update({
+            field + '_count': c[field + '_count'] + n,
+            field + '_min': case([(or_(low.is_(None), low > lo), lo)], else_=low),
+            field + '_max': case([(or_(high.is_(None), high < hi), hi)], else_=high),
+            field + '_sum': c[field + '_sum'] + total,
+            field + '_sqsum': c[field + '_sqsum'] + sq,
+        })
+        values.update({
+            field + '_count': n,
+            field + '_min': lo,
+            field + '_max': hi,
+            field + '_sum': total,
+            field + '_sqsum': sq,
+        })
+    if not changes:
+        return
+    # every rollup table has a single writer, the sensor of its model
+    if not conn.execute(table.update().where(c.start == start).values(**changes)).rowcount:
+        conn.execute(table.insert().values(**values))
+
+
+def add_samples(conn, samples):
+    """
+    merge written samples of one model into all its rollups
+
+    bucket starts come from the database like in rebuild(), so both agree
+    on time zones. samples are found by their unique creation_time.
+    """
+    if not samples:
+        return
+    Model = type(samples[0])
+    if not Model.rollups:
+        return
+    epochs = dict(conn.execute(
+        select([Model.creation_time, db.unix_epoch(Model.creation_time).label('epoch')]).where(
+            Model.creation_time.in_([s.creation_time for s in samples])
+        )
+    ).fetchall())
+    epochs = [epochs[s.creation_time] for s in samples]
+    for Rollup in Model.rollups:
+        for start, stats in bucket_stats(epochs, samples, Model.rollup_fields, Rollup.width).items():
+            merge_bucket(conn, Rollup, start, stats)
+
+
+def rebuild(Model, engine=None):
+    """recreate all rollups of Model from the raw samples"""
+    engine = engine or db.engine
+    for Rollup in Model.rollups:
+        start = db.time_bucket(Model.creation_time, Rollup.width) * Rollup.width
+        names, columns = ['start'], [start]
+        for field in Model.rollup_fields:
+            column = getattr(Model, field)
+            names += [field + '_count', field + '_min', field + '_max', field + '_sum', field + '_sqsum']
+            columns += [
+                func.count(column),
+                func.min(column),
+                func.max(column),
+                func.coalesce(func.sum(column), 0),
+                func.coalesce(func.sum(column * column), 0)
+            ]
+        with engine.begin() as conn:
+            conn.execute(Rollup.__table__.delete())
+            conn.execute(
+                Rollup.__table__.insert().from_select(
+                    names, select(columns).group_by(start)
+                )
+            )
+        print(" +++ rebuilt", Rollup.__tablename__)
+
+
+def choose_rollup(Model, width):
+    """coarsest rollup of Model whose buckets fit into width seconds"""
+    fitting = [Rollup for Rollup in Model.rollups if Rollup.width <= width]
+    return fitting[-1] if fitting else None
+
+
+def bucket_query(Rollup, start, end, width, fields):
+    """
+    merge the rollup buckets between start and end into buckets of width seconds
+
+    :return: query and column names in the layout of readout.prepare_buckets
+    """
+    width = int(ceil(width / Rollup.width)) * Rollup.width
+    c = Rollup.__table__.c
+    bucket = c.start - c.start % width
+    window = and_(
+        c.start > db.unix_epoch(literal(start)) - Rollup.width,
+        c.start < db.unix_epoch(literal(end))
+    )
+    names = ['time', 'count']
+    columns = [bucket + width / 2, func.sum(c[fields[0] + '_count'])]
+    for field in fields:
+        names += [field + '_min', field, field + '_max']
+        columns += [
+            func.min(c[field + '_min']),
+            func.sum(c[field + '_sum']) / func.nullif(func.sum(c[field + '_count']), 0),
+            func.max(c[field + '_max'])
+        ]
+    query = select(
+        [column.label(name) for column, name in zip(columns, names)]
+    ).where(window).group_by(bucket).order_by(bucket)
+    return query, names
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+fixed rate sampling of all sensors from one asyncio loop
+
+every sensor is read on an absolute timetable, aligned to multiples of
+its delay in wall-clock time, so read and write times do not stretch the
+interval. blocking reads run in daemon threads with a timeout per read,
+failed and timed out reads are recorded as missed reads, samples that
+fail to be queued are counted and dropped. a read that overruns the next
+deadlines skips them and reports how many were missed. an adaptive
+sensor moves its timetable to its new delay after a read.
+
+the ingest metrics are served as json on the unix socket ingest.socket.
+"""
+import asyncio
+import os
+import signal
+import time
+from datetime import datetime
+from concurrent.futures import Executor, Future
+from threading import Thread
+from . import sensors as sensors_module
+from .config import cfg
+from .metrics import metrics
+from .threaded import Collector, writer
+
+__all__ = [
+    'Timetable',
+    'run_scheduler'
+]
+
+
+class DaemonExecutor(Executor):
+    """
+    a daemon thread per call
+
+    the workers of a ThreadPoolExecutor are joined when the interpreter
+    exits, so a hung sensor read would keep the gatherer from stopping.
+    every sensor has at most one read and one commit running.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        Thread(target=run, name="baropi-sensor", daemon=True).start()
+        return future
+
+
+class Timetable:
+    """deadlines every period seconds on the loop clock"""
+
+    def __init__(self, period, now, wall=None):
+        self.period = period
+        wall = time.time() if wall is None else wall
+        # the first deadline on the next wall-clock multiple of period
+        self.start = now + (-wall) % period
+        self.tick = 0
+        self.missed = 0
+
+    @property
+    def deadline(self):
+        return self.start + self.tick * self.period
+
+    def retime(self, period):
+        """keep the current deadline, the following ones every period seconds"""
+        self.start, self.tick, self.period = self.deadline, 0, period
+
+    def advance(self, now):
+        """step to the next deadline after now, return the deadlines skipped"""
+        self.tick += 1
+        late = now - self.deadline
+        skipped = int(late // self.period) + 1 if late > 0 else 0
+        self.tick += skipped
+        self.missed += skipped
+        return skipped
+
+
+async def read_sample(collector, executor, pending):
+    """
+    the next sample of the collector, None for a missed read
+
+    a read is given up after the timeout of its sensor. its worker can
+    not be interrupted, so no new read starts until it returned, and
+    its late result is dropped.
+    """
+    loop = asyncio.get_event_loop()
+    sensor = collector.sensor
+    when = datetime.now()
+    if pending is not None and not pending.done():
+        await loop.run_in_executor(executor, collector.missed, "previous read still running", when)
+        return None, pending
+
+    pending = loop.run_in_executor(executor, collector.read)
+    try:
+        return await asyncio.wait_for(asyncio.shield(pending), sensor.timeout), None
+    except asyncio.TimeoutError:
+        metrics.count(sensor.name, 'timeouts')
+        reason = "no answer within {}s".format(sensor.timeout)
+        # the late outcome is dropped, also its exception
+        pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+    except Exception as e:
+        reason = repr(e)
+    await loop.run_in_executor(executor, collector.missed, reason, when)
+    return None, pending
+
+
+async def sample_sensor(collector, stopping, executor):
+    loop = asyncio.get_event_loop()
+    timetable = Timetable(collector.sensor.delay, loop.time())
+    name = collector.sensor.name
+    pending = None
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), max(0., timetable.deadline - loop.time()))
+            break
+        except asyncio.TimeoutError:
+            pass
+        metrics.record(name, 'lag', max(0., loop.time() - timetable.deadline))
+        sample, pending = await read_sample(collector, executor, pending)
+        if sample is not None:
+            try:
+                await loop.run_in_executor(executor, collector.commit, sample)
+            except Exception as e:
+                metrics.count(name, 'commit_failures')
+                print(" --- failed to queue", name, "sample:", repr(e))
+        if collector.sensor.delay != timetable.period:
+            # an adaptive sensor changed its rate
+            timetable.retime(collector.sensor.delay)
+        skipped = timetable.advance(loop.time())
+        if skipped:
+            metrics.count(name, 'missed', skipped)
+            print(" --- {} missed {} deadline(s) of {}s, {} so far".format(
+                name, skipped, timetable.period, timetable.missed))
+    collector.close()
+
+
+async def send_metrics(reader, stream):
+    stream.write(metrics.dumps().encode() + b"\n")
+    await stream.drain()
+    stream.close()
+
+
+async def serve_metrics(path, stopping):
+    """answer every connection to the unix socket at path with the metrics as json"""
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(send_metrics, path)
+    await stopping.wait()
+    server.close()
+    await server.wait_closed()
+    os.unlink(path)
+
+
+async def dump_metrics(interval, stopping):
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), interval)
+        except asyncio.TimeoutError:
+            for line in metrics.summary():
+                print(" +++", line)
+
+
+async def run_sensors(sensor_defs, stopping=None):
+    stopping = stopping or asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    collectors = [
+        Collector(getattr(sensors_module, d['module'])(**d)) for d in sensor_defs
+    ]
+    tasks = []
+    if cfg.ingest.socket:
+        tasks.append(serve_metrics(cfg.ingest.socket, stopping))
+    if cfg.ingest.dump:
+        tasks.append(dump_metrics(cfg.ingest.dump, stopping))
+    executor = DaemonExecutor()
+    await asyncio.gather(*tasks + [
+        sample_sensor(collector, stopping, executor) for collector in collectors
+    ])
+
+
+def run_scheduler(sensor_defs):
+    """sample all sensors until SIGINT or SIGTERM, then write the queued samples"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run_sensors(sensor_defs))
+    finally:
+        print(" +++ stopping, writing queued samples")
+        writer.close()
+        loop.close()
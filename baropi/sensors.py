@@ -1,10 +1,12 @@
 import shutil as s
 import psutil as ps
-from os.path import isfile
-from subprocess import check_output
 from datetime import datetime
+from time import sleep, monotonic
 from . import models as m
-from . import resources as r
+from .config import cfg
+from .metrics import metrics, RETRIES
+from .sysfs import Thermal, CpuFreq, MemInfo
+from .adaptive import make_adaptive_rate
 
 
 try:
@@ -21,6 +23,10 @@ except ImportError:
         def read_retry(s, p):
             return randrange(100), randrange(30)
 
+        @staticmethod
+        def read(s, p):
+            return randrange(100), randrange(30)
+
 
 def tomb(n):
     return n / 1000 ** 2
@@ -29,38 +35,85 @@ def tomb(n):
 class Sensor:
     name = "noop"
     path = "get"
+    resource_names = ()
 
     def __init__(self, pin, delay, model, *args, **kwargs):
         self.pin = pin
         self.delay = delay
         self.Model = model
-        self.resources = []
+        # read policy from cfg.reads, overridden by the entry of the sensor
+        for key in ('timeout', 'retries', 'retry_delay', 'backoff'):
+            setattr(self, key, kwargs.get(key, getattr(cfg.reads, key)))
+        # delay follows the readings, see adaptive
+        self.adaptive = make_adaptive_rate(model, delay, kwargs.get('adaptive'))
+        if self.adaptive:
+            self.delay = self.adaptive.delay
+
+    @property
+    def resources(self):
+        # flask is only needed by the server
+        from . import resources as r
+        return [getattr(r, name) for name in self.resource_names]
 
     def gather(self):
         raise NotImplementedError('you need to override gather() method of your Sensor')
 
     def get_sample(self):
-        return self.Model(
+        # taken when the sensor was read, not when the row is written.
+        # whole seconds survive every TIMESTAMP column unchanged
+        sample = self.Model(
+            creation_time=datetime.now().replace(microsecond=0),
             **self.gather()
         )
+        if self.adaptive:
+            self.adapt(sample)
+        return sample
+
+    def adapt(self, sample):
+        delay = self.adaptive.update(monotonic(), {
+            field: getattr(sample, field, None) for field in self.adaptive.rates
+        })
+        if delay != self.delay:
+            if delay == self.adaptive.min_delay:
+                print(" +++", self.name, "changes fast, reading every", delay, "seconds")
+            self.delay = delay
+        metrics.record(self.name, 'delay', delay)
+
+    def missed_read(self, reason, when=None):
+        """a record that a read failed and why, kept apart from the samples"""
+        return m.MissedRead(
+            sensor=self.name,
+            creation_time=(when or datetime.now()).replace(microsecond=0),
+            reason=str(reason)[:1024]
+        )
 
 
 class DHT22Sensor(Sensor):
     name = "dht22"
+    resource_names = (
+        'ViewDHT22',
+        'ViewDHT22Series',
+        'ViewDHT22Stats',
+    )
 
     def __init__(self, *args, **kwargs):
         Sensor.__init__(self, model=m.ClimateSample, *args, **kwargs)
-        self.resources = [
-            r.ViewDHT22,
-        ]
 
     def gather(self):
-        humidity, temperature = dht.read_retry(
-            dht.DHT22,
-            self.pin
-        )
-        if not humidity or not temperature:
-            raise RuntimeError("ResSensor %s failed to grab data" % self)
+        # read_retry of Adafruit_DHT with backoff, giving up before the timeout
+        start, delay, retry = monotonic(), self.retry_delay, 0
+        # at least one read, whatever reads.retries says
+        for retry in range(max(0, self.retries) + 1):
+            humidity, temperature = dht.read(dht.DHT22, self.pin)
+            if humidity is not None and temperature is not None:
+                break
+            if retry == self.retries or monotonic() - start + delay >= self.timeout:
+                break
+            sleep(delay)
+            delay *= self.backoff
+        metrics.record(self.name, 'retries', retry, RETRIES)
+        if humidity is None or temperature is None:
+            raise RuntimeError("ResSensor %s failed to grab data after %s retries" % (self, retry))
         return {
             'humidity': round(humidity, 3),
             'temperature': round(temperature, 3)
@@ -69,55 +122,99 @@ class DHT22Sensor(Sensor):
 
 class SentinelSensor(Sensor):
     name = "sentinel"
+    resource_names = (
+        'ViewSentinel',
+        'ViewSentinelSeries',
+        'ViewSentinelStats',
+    )
+
+    # values read together, by their key in sentinel.intervals
+    groups = (
+        ('temperature', 'get_temp'),
+        ('freq', 'get_freq'),
+        ('memory', 'get_memory'),
+        ('disk', 'get_disk'),
+        ('limits', 'get_limits'),
+    )
 
     def __init__(self, *args, **kwargs):
         Sensor.__init__(self, model=m.SentinelSample, *args, **kwargs)
-        self.resources = [
-            r.ViewSentinel,
-        ]
+        # opened once, read again for every sample
+        self.thermal = Thermal(kwargs.get('thermal', cfg.sentinel.thermal))
+        self.cpufreq = CpuFreq(kwargs.get('cpufreq', cfg.sentinel.cpufreq))
+        self.meminfo = MemInfo()
+        self.intervals = dict(vars(cfg.sentinel.intervals), **kwargs.get('intervals', {}))
+        # monotonic time when each group is read again
+        self.due = {group: 0. for group, _ in self.groups}
+        self.carry = kwargs.get('carry', cfg.sentinel.carry)
+        self.last = {}
 
     def get_temp(self):
-        measure = None
-        if isfile("/sys/class/thermal/thermal_zone0/temp"):
-            temp = check_output(['cat', '/sys/class/thermal/thermal_zone0/temp']).decode()
-            measure = int(temp) / 1000
+        zones = self.thermal.temperatures()
+        data = {
+            "temperature": zones[0][1] if zones else None
+        }
+        if len(zones) > 1:
+            data["extra"] = " ".join(
+                "{}={}".format(zone, value) for zone, value in zones[1:] if value is not None
+            )
+        return data
 
+    def get_freq(self):
+        current = self.cpufreq.current()
+        if current is None and hasattr(ps, "cpu_freq"):
+            current = ps.cpu_freq()[0]
         return {
-            "temperature": measure
+            "freq_current": current
         }
 
-    def gather(self):
+    def get_limits(self):
+        limits = self.cpufreq.limits()
+        if limits is None and hasattr(ps, "cpu_freq"):
+            limits = ps.cpu_freq()[1:3]
+        if limits is None:
+            return {}
+        return {
+            "freq_min": limits[0],
+            "freq_max": limits[1]
+        }
+
+    def get_memory(self):
+        vms = self.meminfo.virtual_memory()
+        if vms is None:
+            # no procfs, e.g. not on linux
+            vms = ps.virtual_memory()._asdict()
+        return {
+            "total_ram": tomb(vms['total']),
+            "avail_ram": tomb(vms['available']),
+            "percent_ram": vms['percent'],
+            "used_ram": tomb(vms['used']),
+            "free_ram": tomb(vms['free']),
+            "active_ram": tomb(vms['active']),
+            "inactive_ram": tomb(vms['inactive']),
+            "buffer": tomb(vms['buffers']),
+            "cached": tomb(vms['cached']),
+            "shared": tomb(vms['shared'])
+        }
+
+    def get_disk(self):
         du = s.disk_usage('/')
-        data = {
+        return {
             "disk_total": tomb(du[0]),
             "disk_used": tomb(du[1]),
             "disk_free": tomb(du[2])
         }
-        if hasattr(ps, "cpu_freq"):
-            freq = ps.cpu_freq()
-            data.update(
-                {
-                    "freq_current": freq[0],
-                    "freq_min": freq[1],
-                    "freq_max": freq[2]
-                }
-            )
-        vms = ps.virtual_memory()
-        data.update(
-            {
-                "total_ram": tomb(vms[0]),
-                "avail_ram": tomb(vms[1]),
-                "percent_ram": vms[2],
-                "used_ram": tomb(vms[3]),
-                "free_ram": tomb(vms[4]),
-                "active_ram": tomb(vms[5]),
-                "inactive_ram": tomb(vms[6]),
-                "buffer": tomb(vms[7]),
-                "cached": tomb(vms[8]),
-                "shared": tomb(vms[9])
-            }
-        )
-        data.update(
-            self.get_temp()
-        )
-        return data
\ No newline at end of file
+
+    def gather(self):
+        """the groups that are due, the others carried forward or left empty"""
+        data = {}
+        now = monotonic()
+        for group, reader in self.groups:
+            # half a delay early is on time, the delay may change
+            if now >= self.due[group] - self.delay / 2:
+                data.update(getattr(self, reader)())
+                self.due[group] = now + self.intervals.get(group, 0)
+        if not self.carry:
+            return data
+        self.last.update(data)
+        return dict(self.last)
\ No newline at end of file
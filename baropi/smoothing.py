@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+streaming low-pass of the sensor series
+
+the gatherer updates one ExponentialSmoother per series with every sample
+and stores the result in the <field>_smooth column of the sample. the
+newest stored row is the filter state, so a restarted gatherer resumes
+where it stopped and graphs read the smoothed values instead of
+filtering the whole window on every request.
+
+moving_average is the batch smoother of the graphs, its window is given
+in seconds so the smoothing does not depend on the sampling density.
+"""
+from math import exp, isnan
+import numpy as np
+from sqlalchemy import select
+from . import database as db
+
+__all__ = [
+    'ExponentialSmoother',
+    'SeriesSmoother',
+    'smooth_series',
+    'moving_average'
+]
+
+
+class ExponentialSmoother:
+    """
+    first order IIR low-pass with time constant tau seconds
+
+    the coefficient follows the time since the last sample, so irregular
+    sampling is handled, and after gaps longer than max_gap taus the
+    filter restarts at the next reading.
+    """
+
+    def __init__(self, tau, value=None, time=None, max_gap=10):
+        self.tau = tau
+        self.value = value
+        self.time = time
+        self.max_gap = max_gap
+
+    def update(self, value, time):
+        if value is None or isnan(value):
+            return self.value
+        dt = time - self.time if self.time is not None else None
+        if self.value is None or dt is None or not 0 <= dt <= self.max_gap * self.tau:
+            self.value = float(value)
+        else:
+            self.value += (1 - exp(-dt / self.tau)) * (value - self.value)
+        self.time = time
+        return self.value
+
+
+class SeriesSmoother:
+    """an ExponentialSmoother per smooth field of a sample model"""
+
+    def __init__(self, Model, tau):
+        self.Model = Model
+        self.smoothers = {
+            field: ExponentialSmoother(tau) for field in Model.smooth_fields
+        }
+
+    def resume(self, conn):
+        """continue from the newest stored smoothed values of the model"""
+        Model = self.Model
+        row = conn.execute(
+            select(
+                [db.unix_epoch(Model.creation_time).label('epoch')] +
+                [getattr(Model, field + '_smooth') for field in Model.smooth_fields]
+            ).order_by(Model.id.desc()).limit(1)
+        ).first()
+        if row is not None:
+            for field, value in zip(Model.smooth_fields, row[1:]):
+                self.smoothers[field].value = value
+                self.smoothers[field].time = float(row[0]) if value is not None else None
+        return self
+
+    def apply(self, sample, time):
+        for field, smoother in self.smoothers.items():
+            setattr(sample, field + '_smooth', smoother.update(getattr(sample, field), time))
+
+
+def smooth_series(times, values, smoother):
+    """run smoother over a whole series, for the history of a column"""
+    out = np.empty(len(values))
+    for i, (t, v) in enumerate(zip(times, values)):
+        smoothed = smoother.update(v, t)
+        out[i] = np.nan if smoothed is None else smoothed
+    return out
+
+
+def moving_average(times, values, window, weights=None):
+    """
+    centered moving average over window seconds of wall-clock time
+
+    the bounds of every window are found by binary search in the sorted
+    times and the sums taken from cumulative sums, so the cost does not
+    grow with the window. a window never bridges a gap wider than itself,
+    NaN values are skipped and weights, e.g. the sample count of time
+    buckets, weigh the values.
+    """
+    t = np.asarray(times, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    w = np.ones(len(y)) if weights is None else np.asarray(weights, dtype=np.float64)
+    finite = np.isfinite(y)
+    if not finite.any():
+        return y
+    # sums of values near zero keep the cumulative sums precise
+    offset = y[finite].mean()
+    w = np.where(finite, w, 0.)
+    wy = np.where(finite, y - offset, 0.) * w
+    sums = np.concatenate(([0.], np.cumsum(wy)))
+    totals = np.concatenate(([0.], np.cumsum(w)))
+    lo = np.searchsorted(t, t - window / 2., 'left')
+    hi = np.searchsorted(t, t + window / 2., 'right')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[hi] - sums[lo]) / (totals[hi] - totals[lo]) + offset
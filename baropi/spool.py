@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+append-only local file for samples the database did not take
+
+every record is a 4 byte length, a 4 byte crc32 and the sample as json.
+appends are flushed to the os right away but only fsynced every
+fsync_interval seconds to spare the sd card, a torn record at the end of
+the file is skipped on reading. drain() moves the file aside, replays it
+in bulk inserts and skips samples whose key is already stored,
+so replaying twice after a crash does no harm.
+"""
+import json
+import os
+import struct
+import zlib
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+from sqlalchemy import inspect, select
+from .models import ClimateSample, SentinelSample, MissedRead
+
+__all__ = [
+    'Spool'
+]
+
+HEADER = struct.Struct('>II')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+MODELS = {Model.__tablename__: Model for Model in (ClimateSample, SentinelSample, MissedRead)}
+
+
+def encode(sample):
+    values = {}
+    for prop in inspect(type(sample)).column_attrs:
+        value = getattr(sample, prop.key)
+        if value is None or prop.key == 'id':
+            continue
+        if isinstance(value, datetime):
+            value = value.strftime(TIME_FORMAT + ('.%f' if value.microsecond else ''))
+        values[prop.key] = value
+    return json.dumps({'model': sample.__tablename__, 'values': values}).encode()
+
+
+def decode(payload):
+    record = json.loads(payload.decode())
+    values = record['values']
+    # spools of earlier versions hold isoformat times
+    when = values['creation_time'].replace('T', ' ')
+    values['creation_time'] = datetime.strptime(when, TIME_FORMAT + ('.%f' if '.' in when else ''))
+    return MODELS[record['model']](**values)
+
+
+def read_records(fd):
+    """samples of all complete records from fd, stops at a torn tail"""
+    while True:
+        header = fd.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        size, crc = HEADER.unpack(header)
+        payload = fd.read(size)
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            print(" --- spool ends in a damaged record, skipping the rest")
+            return
+        yield decode(payload)
+
+
+class Spool:
+    def __init__(self, path, fsync_interval=5.):
+        self.path = path
+        self.draining = path + '.draining'
+        self.fsync_interval = fsync_interval
+        self.lock = Lock()
+        self.fd = None
+        self.synced = monotonic()
+        self.appended = 0
+        self.replayed = 0
+
+    def __len__(self):
+        """bytes waiting to be drained"""
+        return sum(os.path.getsize(p) for p in (self.path, self.draining) if os.path.exists(p))
+
+    def append(self, samples):
+        with self.lock:
+            if self.fd is None:
+                self.fd = open(self.path, 'ab')
+            for sample in samples:
+                payload = encode(sample)
+                self.fd.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.fd.flush()
+            self.appended += len(samples)
+            if monotonic() - self.synced >= self.fsync_interval:
+                self.sync()
+
+    def sync(self):
+        if self.fd is not None:
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+        self.synced = monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self.sync()
+                self.fd.close()
+                self.fd = None
+
+    def drain(self, engine, insert, chunk_size=5000):
+        """
+        replay spooled samples with insert(conn, samples), one transaction per chunk
+
+        a draining file left by an earlier run is replayed first. on errors
+        the draining file stays and the next drain starts over.
+        """
+        with self.lock:
+            if not os.path.exists(self.draining):
+                if not os.path.exists(self.path):
+                    return 0
+                if self.fd is not None:
+                    self.sync()
+                    self.fd.close()
+                    self.fd = None
+                os.rename(self.path, self.draining)
+
+        done = 0
+        with open(self.draining, 'rb') as fd:
+            chunk = []
+            for sample in read_records(fd):
+                chunk.append(sample)
+                if len(chunk) >= chunk_size:
+                    done += self.replay(engine, insert, chunk)
+                    chunk = []
+            done += self.replay(engine, insert, chunk)
+        os.unlink(self.draining)
+        self.replayed += done
+        print(" +++ replayed", done, "spooled samples")
+        return done
+
+    @staticmethod
+    def replay(engine, insert, samples):
+        if not samples:
+            return 0
+        with engine.begin() as conn:
+            fresh = []
+            by_model = {}
+            for sample in samples:
+                by_model.setdefault(type(sample), []).append(sample)
+            for Model, spooled in by_model.items():
+                times = [s.creation_time for s in spooled]
+                stored = {
+                    tuple(row) for row in conn.execute(
+                        select([getattr(Model, field) for field in Model.unique_fields]).where(
+                            Model.creation_time.between(min(times), max(times))
+                        )
+                    )
+                }
+                # a sample can be spooled twice when a commit failed late
+                unique = {s.key: s for s in spooled if s.key not in stored}
+                fresh += list(unique.values())
+            insert(conn, fresh)
+        return len(fresh)
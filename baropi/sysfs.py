@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+sysfs and procfs values without a process or an open() per sample
+
+every source is opened once and read again with pread at offset 0, which
+makes the kernel generate fresh contents. numbers are parsed straight
+from the bytes read. a source that is missing or goes away reads as None.
+"""
+import os
+from glob import glob
+
+__all__ = [
+    'SysFile',
+    'MemInfo',
+    'Thermal',
+    'CpuFreq'
+]
+
+THERMAL = "/sys/class/thermal"
+CPUFREQ = "/sys/devices/system/cpu/cpufreq"
+MEMINFO = "/proc/meminfo"
+
+
+class SysFile:
+    """one sysfs or procfs file, kept open"""
+
+    def __init__(self, path, size=64):
+        self.path = path
+        self.size = size
+        try:
+            self.fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            self.fd = None
+
+    def read(self):
+        if self.fd is None:
+            return None
+        try:
+            return os.pread(self.fd, self.size, 0)
+        except OSError:
+            return None
+
+    def number(self, scale=1):
+        """the file as an integer divided by scale"""
+        raw = self.read()
+        try:
+            return int(raw) / scale
+        except (TypeError, ValueError):
+            return None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class MemInfo(SysFile):
+    """the fields of /proc/meminfo used for virtual memory, in bytes"""
+    # with the line break, so Cached does not match SwapCached
+    FIELDS = {
+        'total': b'MemTotal:',
+        'free': b'\nMemFree:',
+        'available': b'\nMemAvailable:',
+        'buffers': b'\nBuffers:',
+        'cached': b'\nCached:',
+        'reclaimable': b'\nSReclaimable:',
+        'active': b'\nActive:',
+        'inactive': b'\nInactive:',
+        'shared': b'\nShmem:',
+    }
+
+    def __init__(self, path=MEMINFO):
+        SysFile.__init__(self, path, size=8192)
+
+    def fields(self):
+        raw = self.read()
+        if not raw:
+            return None
+        values = {}
+        for name, key in self.FIELDS.items():
+            start = raw.find(key)
+            if start < 0:
+                values[name] = 0
+                continue
+            start += len(key)
+            values[name] = int(raw[start:raw.find(b'kB', start)]) * 1024
+        return values
+
+    def virtual_memory(self):
+        """like psutil.virtual_memory() on linux, None without meminfo"""
+        f = self.fields()
+        if f is None:
+            return None
+        total, available = f['total'], f['available']
+        return {
+            'total': total,
+            'available': available,
+            'percent': round((total - available) / total * 100, 1),
+            'used': total - available,
+            'free': f['free'],
+            'active': f['active'],
+            'inactive': f['inactive'],
+            'buffers': f['buffers'],
+            'cached': f['cached'] + f['reclaimable'],
+            'shared': f['shared'],
+        }
+
+
+class Thermal:
+    """temperatures of thermal zones in degrees celsius"""
+
+    def __init__(self, zones=("thermal_zone0",), base=THERMAL):
+        self.zones = [(zone, SysFile(os.path.join(base, zone, "temp"))) for zone in zones]
+
+    def temperatures(self):
+        return [(zone, source.number(1000)) for zone, source in self.zones]
+
+
+class CpuFreq:
+    """
+    frequencies in MHz over cpufreq policies
+
+    the current frequency is the mean of the policies, the limits are
+    the lowest minimum and the highest maximum.
+    """
+
+    def __init__(self, policies=(), base=CPUFREQ):
+        paths = [os.path.join(base, p) for p in policies] or sorted(
+            glob(os.path.join(base, "policy[0-9]*")), key=lambda p: int(p.rsplit("policy", 1)[1]))
+        self.current_files = [SysFile(os.path.join(path, "scaling_cur_freq")) for path in paths]
+        self.limit_files = [
+            (SysFile(os.path.join(path, "scaling_min_freq")), SysFile(os.path.join(path, "scaling_max_freq")))
+            for path in paths
+        ]
+
+    def current(self):
+        values = [f.number(1000) for f in self.current_files]
+        values = [v for v in values if v is not None]
+        return sum(values) / len(values) if values else None
+
+    def limits(self):
+        values = [(low.number(1000), high.number(1000)) for low, high in self.limit_files]
+        values = [v for v in values if None not in v]
+        if not values:
+            return None
+        return min(v[0] for v in values), max(v[1] for v in values)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+wall time, peak memory and error of the graph smoothing filters
+
+every filter runs on a noisy daily sine sampled every 10 seconds, ssqe is
+measured against the noise free sine. results are printed and written as
+json, so runs on different hardware or versions can be compared.
+
+usage: bench_filters.py [output.json] [repeat] [sizes,...]
+"""
+import json
+import platform
+import tracemalloc
+from datetime import datetime
+from sys import argv
+from timeit import default_timer as timer
+import numpy as np
+import scipy
+from scipy import signal
+from scipy.ndimage import gaussian_filter1d
+from baropi import readout
+from baropi.smoothing import ExponentialSmoother, moving_average, smooth_series
+
+INTERVAL = 10.
+WINDOW = 900.
+SIZES = (10000, 100000, 1000000)
+
+
+def ssqe(sm, s, npts):
+    return np.sqrt(np.sum(np.power(s - sm, 2))) / npts
+
+
+def known_signal(n, sigma=.5):
+    rng = np.random.RandomState(0)
+    t = 1.5e9 + np.arange(n) * INTERVAL
+    s = 21 + 3 * np.sin(t / 86400 * 2 * np.pi)
+    return t, s, s + rng.normal(0, sigma, n)
+
+
+def savgol(t, y):
+    """the graph filter before the time based window, 2.5% of the samples"""
+    window = min(max(3, readout.nearest_odd(len(y) * 25 / 1000)), readout.nearest_odd(len(y) - 1))
+    return signal.savgol_filter(y, window, 1)
+
+
+samples = int(WINDOW / INTERVAL)
+filters = {
+    'savgol': savgol,
+    'hann_smooth': lambda t, y: readout.hann_smooth(y, samples),
+    'butter_filtfilt': lambda t, y: readout.butter_lowpass_filtfilt(
+        y, 1 / WINDOW, 1 / INTERVAL, order=4
+    ),
+    'gaussian': lambda t, y: gaussian_filter1d(y, samples / 4.),
+    'moving_average': lambda t, y: moving_average(t, y, WINDOW),
+    'ema': lambda t, y: smooth_series(t, y, ExponentialSmoother(WINDOW / 2)),
+}
+
+
+def bench(name, n, repeat):
+    t, s, y = known_signal(n)
+    f = filters[name]
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        out = f(t, y)
+        times.append(timer() - start)
+
+    tracemalloc.start()
+    f(t, y)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'filter': name,
+        'points': n,
+        'seconds': min(times),
+        'peak_bytes': peak,
+        'ssqe': float(ssqe(out, s, n)),
+    }
+
+
+if __name__ == '__main__':
+    output = argv[1] if len(argv) > 1 else 'bench_filters.json'
+    repeat = int(argv[2]) if len(argv) > 2 else 3
+    sizes = [int(n) for n in argv[3].split(',')] if len(argv) > 3 else SIZES
+
+    results = []
+    for n in sizes:
+        for name in filters:
+            result = bench(name, n, repeat)
+            results.append(result)
+            print("{filter:16} {points:8}  {ms:10.1f} ms  {mb:8.1f} MiB  ssqe {ssqe:.3e}".format(
+                ms=result['seconds'] * 1000, mb=result['peak_bytes'] / 2 ** 20, **result))
+
+    with open(output, 'w') as fd:
+        json.dump({
+            'date': datetime.utcnow().isoformat(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'interval': INTERVAL,
+            'window': WINDOW,
+            'repeat': repeat,
+            'results': results,
+        }, fd, indent=2)
+    print(" +++ results written to", output)
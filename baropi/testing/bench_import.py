@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+import time and memory of the gatherer side of baropi
+
+`import baropi` runs in a fresh interpreter with -X importtime. the script
+prints the cumulative import time, the slowest imported packages and the
+peak RSS, and exits with an error when one of the graph or server
+dependencies got imported, so they do not creep back into the gatherer.
+
+usage: bench_import.py [module] [top]
+
+needs python 3.7 or later for -X importtime.
+"""
+import json
+import subprocess
+import sys
+from sys import argv
+
+HEAVY = ('matplotlib', 'mpl_toolkits', 'scipy', 'pendulum', 'flask', 'flask_restful', 'redisworks')
+
+probe = """
+import json, resource, sys
+import {module}
+print(json.dumps({{
+    'maxrss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': sorted(sys.modules),
+}}))
+"""
+
+
+def importtime(module):
+    """per module self and cumulative import time in us, and the probe result"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', probe.format(module=module)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times, json.loads(proc.stdout.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if sys.version_info < (3, 7):
+        sys.exit(" --- -X importtime needs python 3.7 or later")
+    module = argv[1] if len(argv) > 1 else 'baropi'
+    top = int(argv[2]) if len(argv) > 2 else 15
+
+    times, probed = importtime(module)
+    print(" +++ import {}: {:.0f} ms, peak rss {:.1f} MiB".format(
+        module, times[module][1] / 1000, probed['maxrss_kib'] / 1024))
+
+    packages = {name: t for name, t in times.items() if '.' not in name and name != module}
+    for name, (self_us, cumulative_us) in sorted(packages.items(), key=lambda i: -i[1][1])[:top]:
+        print("{:>10.1f} ms  {}".format(cumulative_us / 1000, name))
+
+    loaded = sorted({m.split('.')[0] for m in probed['modules']} & set(HEAVY))
+    if loaded:
+        print(" --- heavy dependencies imported:", ", ".join(loaded))
+        sys.exit(1)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+cold vs warm render time of the /graph chart
+
+cold builds a new chart template for every render, like every request
+did before, warm reuses the template of the thread.
+"""
+from sys import argv
+from timeit import default_timer as timer
+import numpy as np
+from baropi import readout
+
+
+def synthetic_columns(n, bucketed=False):
+    rng = np.random.RandomState(0)
+    t = 1.5e9 + np.arange(n) * 10.
+    columns = {
+        'time': t,
+        'temperature': 21 + 3 * np.sin(t / 86400 * 2 * np.pi) + rng.normal(0, .2, n),
+        'humidity': 50 + 10 * np.cos(t / 86400 * 2 * np.pi) + rng.normal(0, 1, n),
+    }
+    if bucketed:
+        columns['count'] = np.full(n, 6.)
+        for field in ('temperature', 'humidity'):
+            columns[field + '_min'] = columns[field] - 1
+            columns[field + '_max'] = columns[field] + 1
+    return columns
+
+
+def bench(columns, repeat):
+    cold, warm = [], []
+    for _ in range(repeat):
+        start = timer()
+        readout.Chart().render(columns, readout.cfg.graph.plot_points)
+        cold.append(timer() - start)
+    readout.chart().render(columns, readout.cfg.graph.plot_points)
+    for _ in range(repeat):
+        start = timer()
+        readout.chart().render(columns, readout.cfg.graph.plot_points)
+        warm.append(timer() - start)
+    return min(cold), min(warm)
+
+
+if __name__ == '__main__':
+    repeat = int(argv[1]) if len(argv) > 1 else 5
+    for n, bucketed in [(2160, False), (2000, True), (60480, False)]:
+        cold, warm = bench(synthetic_columns(n, bucketed), repeat)
+        print("{:6} samples{:9}  cold {:7.1f} ms  warm {:7.1f} ms".format(
+            n, " bucketed" if bucketed else "", cold * 1000, warm * 1000))
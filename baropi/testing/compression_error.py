@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+checks that the samples kept by the compressors reproduce every sample
+
+the stored samples are interpolated with np.interp at the time of every
+input sample, the error has to stay within the tolerance for swinging
+door and twice the tolerance for deadband. the inputs are a noisy
+DHT22-like day sampled every 10 seconds and a few hand made series.
+
+usage: compression_error.py [days]
+"""
+from collections import namedtuple
+from sys import argv
+import numpy as np
+from baropi.compression import Compressor, Deadband, SwingingDoor
+
+Sample = namedtuple('Sample', ['timestamp', 'temperature', 'humidity'])
+TOLERANCES = {'temperature': .1, 'humidity': .5}
+BOUNDS = [(SwingingDoor, 1), (Deadband, 2)]
+
+
+def synthetic_day(days):
+    rng = np.random.RandomState(0)
+    t = np.arange(0, days * 86400, 10.)
+    temperature = np.round(21 + 3 * np.sin(t / 86400 * 2 * np.pi) + rng.normal(0, .05, t.size), 1)
+    humidity = np.round(50 + 10 * np.cos(t / 86400 * 2 * np.pi) + rng.normal(0, .3, t.size), 1)
+    return [Sample(*row) for row in zip(t, temperature, humidity)]
+
+
+def hand_made():
+    return [
+        # the held sample at 20 is within the corridor but the line to it is not
+        [Sample(0, 0., 0.), Sample(10, .1, 0.), Sample(20, -.1, 0.), Sample(30, 5., 0.)],
+        [Sample(t, .1 * (t // 10 % 2), 0.) for t in range(0, 600, 10)],
+        [Sample(t, (t / 10) ** 2 / 100, 0.) for t in range(0, 600, 10)],
+    ]
+
+
+def max_errors(samples, Door):
+    compressor = Compressor(TOLERANCES, Door, max_silence=600)
+    stored = []
+    for sample in samples:
+        stored += compressor.add(sample)
+    stored += compressor.flush()
+    t = np.array([s.timestamp for s in samples])
+    kept = np.array([s.timestamp for s in stored])
+    errors = {}
+    for field in TOLERANCES:
+        values = np.array([getattr(s, field) for s in samples])
+        rebuilt = np.interp(t, kept, [getattr(s, field) for s in stored])
+        errors[field] = np.abs(rebuilt - values).max()
+    return errors, len(stored)
+
+
+if __name__ == '__main__':
+    days = float(argv[1]) if len(argv) > 1 else 1
+    failed = False
+    for name, samples in [('day', synthetic_day(days))] + [
+            ('series %d' % i, s) for i, s in enumerate(hand_made())]:
+        for Door, bound in BOUNDS:
+            errors, stored = max_errors(samples, Door)
+            for field, error in errors.items():
+                ok = error <= bound * TOLERANCES[field] + 1e-9
+                failed = failed or not ok
+                print("{:10} {:14} {:12} stored {:6}/{:<6} max abs error {:.3f} {}".format(
+                    name, Door.__name__, field, stored, len(samples), error, "ok" if ok else "FAILED"))
+    exit(1 if failed else 0)
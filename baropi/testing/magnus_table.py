@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+checks the precomputed MagnusTable against the Fraction reference in moullier.py
+
+quantized DHT22 readings (0.1 °C / 0.1 %RH) and off-grid readings rounded
+to 3 decimals, like DHT22Sensor.gather() stores them, are compared.
+"""
+from fractions import Fraction
+from sys import argv
+import numpy as np
+from baropi.psychrometrics import MagnusTable
+from baropi.testing.moullier import Moullier
+
+# grid points are plain lookups, between them the linear interpolation
+# has to stay well below the 0.1 resolution of the sensor
+tolerances = {
+    'quantized': {
+        'steampressure_saturated_hPa': 1e-9,
+        'moisture_gpm3': 1e-9,
+        'dew_point_celsius': 1e-9,
+    },
+    'off grid': {
+        'steampressure_saturated_hPa': 2e-3,
+        'moisture_gpm3': 1e-3,
+        'dew_point_celsius': 2e-2,
+    },
+}
+
+
+def reference(t, r):
+    m = Moullier(Fraction(t), Fraction(r))
+    return {
+        'steampressure_saturated_hPa': float(m.Saettigungsdampfdruck_hPa),
+        'moisture_gpm3': float(m.AF),
+        'dew_point_celsius': float(m.Taupunkttemperatur),
+    }
+
+
+def max_errors(table, temperature, humidity):
+    derived = table.derive(temperature, humidity)
+    errors = {}
+    for i, (t, r) in enumerate(zip(temperature, humidity)):
+        for field, value in reference(t, r).items():
+            errors[field] = max(errors.get(field, 0.), abs(derived[field][i] - value))
+    return errors
+
+
+if __name__ == '__main__':
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    rng = np.random.RandomState(0)
+    table = MagnusTable()
+    quantized = (
+        np.round(rng.uniform(table.t_min, table.t_max, n), 1),
+        np.round(rng.uniform(1, 100, n), 1)
+    )
+    off_grid = (
+        np.round(rng.uniform(table.t_min, table.t_max, n), 3),
+        np.round(rng.uniform(1, 100, n), 3)
+    )
+    failed = False
+    for name, (temperature, humidity) in [('quantized', quantized), ('off grid', off_grid)]:
+        for field, error in max_errors(table, temperature, humidity).items():
+            ok = error <= tolerances[name][field]
+            failed = failed or not ok
+            print("{:10} {:28} max abs error {:.3e} {}".format(
+                name, field, error, "ok" if ok else "FAILED"))
+    exit(1 if failed else 0)
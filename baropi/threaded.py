@@ -1,37 +1,78 @@
 #!/usr/bin/env python3
-from threading import Thread, Event
+from time import monotonic
 from sqlalchemy.exc import SQLAlchemyError
 from . import database as db
-from . import sensors as sensors_module
+from .smoothing import SeriesSmoother
+from .compression import make_compressor
+from .writer import WriteBehind
+from .spool import Spool
+from .metrics import metrics
 from .config import cfg, conf
-from redisworks import Root
 
 redis_conf = conf['redis']['connection']
 
+# shared by all sensors of the process
+writer = WriteBehind(
+    cfg.db.batch_size,
+    cfg.db.batch_latency,
+    spool=Spool(cfg.db.spool, cfg.db.spool_fsync) if cfg.db.spool else None
+)
 
-class GrabberThread(Thread):
-    def __init__(self, event, sensor):
-        Thread.__init__(self)
+
+class Collector:
+    """reads samples of one sensor and queues them for the database"""
+
+    def __init__(self, sensor):
         self.sensor = sensor
-        self.stopped = event
         self.db = db.make_session()
+        self.smoothers = {}
+        # the time base of resume() and bin/baropi-backfill
+        self.clock = db.EpochClock()
+        self.compressors = {}
         # if cfg.redis.enabled:
+        #    from redisworks import Root
         #    self.redis = Root(
         #        **conf['redis']['connection'],
         #        root_name="baropi")
         #    print(" +++", self.redis, "connecting to", redis_conf)
 
+    def smoother(self, Model):
+        if Model not in self.smoothers:
+            self.smoothers[Model] = SeriesSmoother(
+                Model, cfg.smoothing.tau
+            ).resume(self.db)
+        return self.smoothers[Model]
+
+    def compressor(self, Model):
+        if Model not in self.compressors:
+            self.compressors[Model] = make_compressor(Model)
+        return self.compressors[Model]
+
     def ask_sensor(self):
         return self.sensor.get_sample()
 
-    def put_db(self, sample):
+    def smooth(self, sample):
+        """
+        fill the _smooth fields of sample
+
+        the smoother resumes from and the clock asks the database. while it
+        is away the sample is stored without them, and smoothing resumes
+        with the first sample after it is back.
+        """
         try:
-            self.db.add(sample)
-            self.db.commit()
-        except SQLAlchemyError as sqlae:
+            self.smoother(type(sample)).apply(sample, self.clock(sample.creation_time))
+        except SQLAlchemyError as e:
             self.db.rollback()
-            print("   --", sqlae.args, sample)
-            raise SQLAlchemyError("general sql db error?!", sqlae.args, sample)
+            metrics.count(self.sensor.name, 'unsmoothed')
+            print(" --- storing", self.sensor.name, "sample without smoothing:", repr(e))
+
+    def put_db(self, sample):
+        sample.fill_derived()
+        if cfg.smoothing.stored and sample.smooth_fields:
+            self.smooth(sample)
+        compressor = self.compressor(type(sample))
+        for stored in compressor.add(sample) if compressor else [sample]:
+            writer.put(stored, self.sensor.name)
 
     def put_redis(self, sample):
 
@@ -47,38 +88,26 @@ class GrabberThread(Thread):
         # if cfg.redis.enabled:
         #    self.put_redis(sample)
 
-    def run(self):
-        while not self.stopped.wait(self.sensor.delay):
-            try:
-                sample = self.ask_sensor()
-            except Exception as e:
-                raise e
-            finally:
-                self.commit(sample)
-
-
-def __create_thread__(threaded_sensor):
-    stop_flag = Event()
-    return GrabberThread(
-        stop_flag,
-        threaded_sensor
-    ), stop_flag
-
+    def close(self):
+        """queue the samples the compressors held back"""
+        for compressor in self.compressors.values():
+            for sample in compressor.flush() if compressor else []:
+                writer.put(sample, self.sensor.name)
 
-def run_sensor_thread(sensor_class_name, pin, delay):
-    try:
-        such_sensor_class = getattr(
-            sensors_module, sensor_class_name
-        )
-
-        thread, stop_flag = __create_thread__(
-            such_sensor_class(
-                pin=pin, delay=delay)
-        )
+    def read(self):
+        name = self.sensor.name
+        start = monotonic()
         try:
-            thread.start()
-        except KeyboardInterrupt:
-            stop_flag.set()
+            sample = self.ask_sensor()
+        except Exception:
+            metrics.count(name, 'read_failures')
+            raise
+        metrics.record(name, 'read', monotonic() - start)
+        return sample
 
-    except:
-        raise ValueError("%s is not a valid sensor!" % sensor_class_name)
\ No newline at end of file
+    def missed(self, reason, when=None):
+        """record a read that gave no sample, instead of failing"""
+        print(" --- missed", self.sensor.name, "sample:", reason)
+        metrics.count(self.sensor.name, 'missed_samples')
+        if cfg.reads.record_missed:
+            writer.put(self.sensor.missed_read(reason, when), self.sensor.name)
@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 # coding=utf-8
-from flask import Flask, g, send_file, request, make_response
+from flask import Flask, g, send_file, request, make_response, abort
 from json import dumps
 from flask_restful import Api
 from . import database as db
 from . import sensors as sensors_module
-from .readout import create_graph, get_last_samples
+from .readout import get_last_series, newest_sample_id
+from .render_cache import RenderCache
+from .render_pool import RenderPool, RenderBusy, RenderTimeout
 from .encoder import APIEncoder
 import mimetypes
 import io
+import socket
+from datetime import timedelta
 from .config import cfg
 
 mimetypes.add_type('image/svg+xml', '.svg')
@@ -20,6 +24,13 @@ settings.setdefault('indent', 2)
 settings.setdefault('sort_keys', True)
 app.config['RESTFUL_JSON'] = settings
 
+render_cache = RenderCache(cfg.graph.cache_size)
+render_pool = RenderPool(
+    cfg.graph.render_workers,
+    cfg.graph.render_queue,
+    cfg.graph.render_timeout
+)
+
 
 @api.representation('application/json')
 def output_json(data, code, headers=None):
@@ -69,26 +80,53 @@ def teardown_request(exception):
         db.remove()
 
 
+graph_args = ('points', 'plot_points')
+
+
 @app.route('/graph')
 def view_graphs():
     delta = {
         key: int("".join(request.args[key]))
-        for key in request.args
+        for key in request.args if key not in graph_args
     }  # flask's requests.args values are a foken list of chars?! just nope.. TODO want beautiful code
-    buf = io.BytesIO()
-    plt, fig = create_graph(
-        get_last_samples(delta)
-    )
-    fig.savefig(
-        buf,
-        pad_inches=0,
-        bbox_inches='tight',
-        dpi=100,
-        format='svg'
-    )
-    buf.seek(0)
-    plt.clf()
-    plt.close()
+    points = request.args.get('points', cfg.graph.points, type=int)
+    plot_points = request.args.get('plot_points', cfg.graph.plot_points, type=int)
+    window = timedelta(**delta).total_seconds(), points, plot_points
+    newest = newest_sample_id()
+    svg = render_cache.get(window, newest)
+    if svg is None:
+        try:
+            svg = render_pool.render(
+                get_last_series(delta, points),
+                plot_points
+            )
+        except RenderBusy:
+            abort(503)
+        except RenderTimeout:
+            abort(504)
+        if svg is None:
+            # no samples in the window, nothing to draw or to keep
+            return make_response('', 204)
+        render_cache.put(window, newest, svg)
+
     return send_file(
-        buf, mimetype='image/svg+xml'
-    )
\ No newline at end of file
+        io.BytesIO(svg), mimetype='image/svg+xml'
+    )
+
+
+@app.route('/ingest')
+def view_ingest():
+    """the ingest metrics of the gatherer, read from its unix socket"""
+    if not cfg.ingest.socket:
+        abort(404)
+    chunks = []
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(2)
+            conn.connect(cfg.ingest.socket)
+            for chunk in iter(lambda: conn.recv(65536), b''):
+                chunks.append(chunk)
+    except OSError as ose:
+        print(" --- gatherer metrics unavailable:", ose)
+        abort(503)
+    return app.response_class(b''.join(chunks), mimetype='application/json')
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+count, min, max, mean, standard deviation and percentiles of a time window
+
+without percentiles the database does the work: the window is split into
+the day, hour and minute buckets of the rollups that fit completely, and
+raw samples for the edges that are left, each part reduced to count, min,
+max, sum and sum of squares. percentiles need the values, so the columns
+are streamed once into numpy instead, and so do compressed samples, which
+are interpolated first.
+"""
+from datetime import timedelta
+from math import ceil, floor, sqrt
+import numpy as np
+from sqlalchemy import select, func, and_, literal
+from . import database as db
+from .config import cfg
+from .readout import prepare_columns
+from .compression import compressed_fields
+
+__all__ = [
+    'window_parts',
+    'reads_samples',
+    'window_stats'
+]
+
+
+def window_parts(lo, hi, rollups):
+    """
+    split the epoch range [lo, hi) into (Rollup, lo, hi) parts, coarsest first
+
+    the Rollup is None for parts that have to be read from raw samples.
+    """
+    if lo >= hi:
+        return []
+    if not rollups:
+        return [(None, lo, hi)]
+    Rollup, finer = rollups[-1], rollups[:-1]
+    a = int(ceil(lo / Rollup.width)) * Rollup.width
+    b = int(floor(hi / Rollup.width)) * Rollup.width
+    if a >= b:
+        return window_parts(lo, hi, finer)
+    return [(Rollup, a, b)] + window_parts(lo, a, finer) + window_parts(b, hi, finer)
+
+
+def rollup_part(Rollup, lo, hi, fields):
+    c = Rollup.__table__.c
+    columns = []
+    for field in fields:
+        columns += [
+            func.sum(c[field + '_count']),
+            func.min(c[field + '_min']),
+            func.max(c[field + '_max']),
+            func.sum(c[field + '_sum']),
+            func.sum(c[field + '_sqsum'])
+        ]
+    return select(columns).where(and_(c.start >= lo, c.start < hi))
+
+
+def sample_part(Model, lo, hi, fields):
+    columns = []
+    for field in fields:
+        column = getattr(Model, field)
+        columns += [
+            func.count(column),
+            func.min(column),
+            func.max(column),
+            func.sum(column),
+            func.sum(column * column)
+        ]
+    return select(columns).where(and_(Model.creation_time >= lo, Model.creation_time < hi))
+
+
+def summary(n, lo, hi, total, sq):
+    if not n:
+        return {'count': 0, 'min': None, 'max': None, 'mean': None, 'stddev': None}
+    mean = total / n
+    return {
+        'count': n,
+        'min': lo,
+        'max': hi,
+        'mean': mean,
+        'stddev': sqrt(max(sq / n - mean * mean, 0.)),
+    }
+
+
+def aggregated_stats(Model, start, end, fields):
+    rollups = Model.rollups if cfg.db.rollups else ()
+    with db.engine.connect() as conn:
+        e0, e1 = (int(e) for e in conn.execute(select([
+            db.unix_epoch(literal(start)).label('start'),
+            db.unix_epoch(literal(end)).label('end')
+        ])).first())
+
+        def when(epoch):
+            return start + timedelta(seconds=epoch - e0)
+
+        acc = {field: [0, None, None, 0., 0.] for field in fields}
+        for Rollup, lo, hi in window_parts(e0, e1, rollups):
+            if Rollup is None:
+                query = sample_part(Model, when(lo), when(hi), fields)
+            else:
+                query = rollup_part(Rollup, lo, hi, fields)
+            row = conn.execute(query).first()
+            for i, field in enumerate(fields):
+                n, low, high, total, sq = row[i * 5:i * 5 + 5]
+                if not n:
+                    continue
+                a = acc[field]
+                a[0] += int(n)
+                a[1] = low if a[1] is None else min(a[1], low)
+                a[2] = high if a[2] is None else max(a[2], high)
+                a[3] += float(total)
+                a[4] += float(sq)
+    return {field: summary(*acc[field]) for field in fields}
+
+
+def column_stats(Model, start, end, fields, percentiles):
+    columns = prepare_columns(start, end, fields, Model)
+    stats = {}
+    for field in fields:
+        values = columns[field][np.isfinite(columns[field])]
+        if not len(values):
+            stats[field] = summary(0, None, None, 0, 0)
+            ranks = [None] * len(percentiles)
+        else:
+            stats[field] = {
+                'count': len(values),
+                'min': float(values.min()),
+                'max': float(values.max()),
+                'mean': float(values.mean()),
+                'stddev': float(values.std()),
+            }
+            ranks = np.percentile(values, percentiles).tolist() if percentiles else []
+        if percentiles:
+            stats[field]['percentiles'] = {'{:g}'.format(p): v for p, v in zip(percentiles, ranks)}
+    return stats
+
+
+def reads_samples(Model, percentiles=()):
+    """True when window_stats reads the samples, which have every column, not aggregates"""
+    # stored samples of a compressed model are no fair sample of it
+    return bool(percentiles) or bool(compressed_fields(Model))
+
+
+def window_stats(Model, start, end, fields, percentiles=()):
+    """
+    statistics of the samples of Model between start and end per field
+
+    :param percentiles: percentiles between 0 and 100 to add, they need
+                        one pass over the samples instead of aggregates
+    :return: dict per field of count, min, max, mean, stddev (of the
+             population) and, when asked for, percentiles
+    """
+    # whole seconds, so epochs and datetimes of the edges agree exactly
+    # and both ways see the same samples
+    start, end = start.replace(microsecond=0), end.replace(microsecond=0)
+    if reads_samples(Model, percentiles):
+        return column_stats(Model, start, end, fields, percentiles)
+    return aggregated_stats(Model, start, end, fields)
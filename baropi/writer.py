@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+group commit of the samples of all sensor threads
+
+sensor threads put their samples into one queue per process, a writer
+thread collects them until db.batch_size samples are waiting or the
+oldest waited db.batch_latency seconds, and writes them with one
+multi-row insert per table in a single transaction.
+
+with a spool, batches the database refuses and samples beyond the
+backlog of the queue go to the local spool file, which is replayed after
+the next successful write.
+
+samples of a second that is already stored, e.g. after the clock stepped
+back, are dropped instead of failing their whole batch. missed reads of
+different sensors in the same second are not duplicates.
+"""
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import monotonic
+from sqlalchemy import inspect, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from . import database as db
+from . import rollups
+from .config import cfg
+from .metrics import metrics
+
+__all__ = [
+    'WriteBehind',
+    'insert_samples'
+]
+
+# bound parameters per statement, the lowest limit is sqlite's
+MAX_PARAMETERS = 999
+
+
+def sample_rows(samples):
+    """column values of samples, with the same keys for every row"""
+    attrs = [
+        (prop.key, prop.columns[0].name) for prop in inspect(type(samples[0])).column_attrs
+    ]
+    # unset columns are left out, so server defaults still apply
+    used = [
+        (key, name) for key, name in attrs
+        if any(getattr(sample, key) is not None for sample in samples)
+    ]
+    return [{name: getattr(sample, key) for key, name in used} for sample in samples]
+
+
+def insert_samples(conn, samples):
+    """write samples of any models with one multi-row insert per table"""
+    by_model = {}
+    for sample in samples:
+        by_model.setdefault(type(sample), []).append(sample)
+    for Model, written in by_model.items():
+        rows = sample_rows(written)
+        chunk = max(1, MAX_PARAMETERS // max(1, len(rows[0])))
+        for i in range(0, len(rows), chunk):
+            conn.execute(Model.__table__.insert().values(rows[i:i + chunk]))
+        if cfg.db.rollups:
+            rollups.add_samples(conn, written)
+
+
+class WriteBehind:
+    STOP = object()
+
+    def __init__(self, batch_size=50, latency=2., backlog=5000, engine=None, spool=None):
+        """
+        :param batch_size: samples that trigger a write
+        :param latency: seconds the oldest sample waits at most
+        :param backlog: unwritten samples kept while the database is away
+        :param spool: Spool taking the samples that cannot be kept
+        """
+        self.batch_size = max(1, batch_size)
+        self.latency = latency
+        self.backlog = backlog
+        self.engine = engine
+        self.spool = spool
+        self.queue = Queue()
+        self.thread = None
+        self.lock = Lock()
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name="baropi-writer")
+                self.thread.start()
+
+    def put(self, sample, source=None):
+        """queue sample, source names it in the metrics, its table by default"""
+        self.start()
+        if not self.thread.is_alive():
+            # nothing would ever take it from the queue
+            self.dropped += 1
+            metrics.count('writer', 'dropped')
+            print(" --- the writer thread is gone, dropped a sample of", source or sample.__tablename__)
+            return
+        if self.spool is not None and self.queue.qsize() >= self.backlog:
+            # the writer is stuck on a slow database
+            try:
+                self.spool.append([sample])
+                metrics.count('writer', 'spooled', 1)
+            except OSError as oe:
+                self.dropped += 1
+                metrics.count('writer', 'dropped')
+                print(" --- backlog full and spooling failed, dropped a sample:", oe)
+            return
+        self.queue.put((sample, source or sample.__tablename__, monotonic()))
+
+    def write(self, batch):
+        with (self.engine or db.engine).begin() as conn:
+            insert_samples(conn, [sample for sample, source, queued in batch])
+
+    def unstored(self, batch):
+        """the items of batch whose key is neither stored nor repeated"""
+        by_model = {}
+        for item in batch:
+            by_model.setdefault(type(item[0]), []).append(item)
+        fresh = []
+        with (self.engine or db.engine).connect() as conn:
+            for Model, items in by_model.items():
+                times = [sample.creation_time for sample, source, queued in items]
+                stored = {
+                    tuple(row) for row in conn.execute(
+                        select([getattr(Model, field) for field in Model.unique_fields]).where(
+                            Model.creation_time.between(min(times), max(times))
+                        )
+                    )
+                }
+                unique = {item[0].key: item for item in items if item[0].key not in stored}
+                fresh += list(unique.values())
+        if len(fresh) < len(batch):
+            self.dropped += len(batch) - len(fresh)
+            metrics.count('writer', 'duplicates', len(batch) - len(fresh))
+            print(" --- dropped", len(batch) - len(fresh), "samples of seconds already stored")
+        return fresh
+
+    def keep(self, batch, error):
+        """spool batch, or return the part of it kept for a retry"""
+        if self.spool is not None:
+            try:
+                self.spool.append([sample for sample, source, queued in batch])
+                print(" --- writing", len(batch), "samples failed, spooling:", error)
+                metrics.count('writer', 'spooled', len(batch))
+                return []
+            except OSError as oe:
+                print(" --- spooling", len(batch), "samples failed too:", oe)
+        print(" --- writing", len(batch), "samples failed, retrying:", error)
+        if len(batch) > self.backlog:
+            self.dropped += len(batch) - self.backlog
+            print(" --- backlog full, dropped", len(batch) - self.backlog, "oldest samples")
+            batch = batch[-self.backlog:]
+        return batch
+
+    def flush(self, batch):
+        """write batch of queued items, return the items that could not be written"""
+        start = monotonic()
+        try:
+            try:
+                self.write(batch)
+            except IntegrityError:
+                batch = self.unstored(batch)
+                if batch:
+                    self.write(batch)
+        except SQLAlchemyError as sqlae:
+            metrics.count('writer', 'write_failures')
+            return self.keep(batch, sqlae.args)
+        except Exception as e:
+            # not the database, the same batch would fail again
+            metrics.count('writer', 'write_failures')
+            self.dropped += len(batch)
+            print(" --- writing", len(batch), "samples failed, dropped them:", repr(e))
+            return []
+        done = monotonic()
+        metrics.record('writer', 'batch', done - start)
+        for sample, source, queued in batch:
+            # from the read until the transaction is committed
+            metrics.record(source, 'commit', done - queued)
+        self.written += len(batch)
+        self.batches += 1
+        if self.spool is not None and len(self.spool):
+            self.drain()
+        return []
+
+    def drain(self):
+        try:
+            self.spool.drain(self.engine or db.engine, insert_samples)
+        except Exception as e:
+            # the draining file stays for the next try
+            metrics.count('writer', 'write_failures')
+            print(" --- replaying the spool failed, trying again later:", repr(e))
+
+    def run(self):
+        batch, deadline, stopping = [], None, False
+        # a batch kept after a failed write waits for its deadline, however full
+        retrying = False
+        while not stopping:
+            timeout = None if not batch else max(0., deadline - monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = None
+            if item is self.STOP:
+                stopping = True
+            elif item is not None:
+                if not batch:
+                    deadline = monotonic() + self.latency
+                batch.append(item)
+            full = not retrying and len(batch) >= self.batch_size
+            if batch and (stopping or full or monotonic() >= deadline):
+                batch = self.flush(batch)
+                retrying = bool(batch)
+                # failed writes wait another latency before the retry
+                deadline = monotonic() + self.latency
+        if batch:
+            print(" --- lost", len(batch), "samples that could not be written on shutdown")
+        if self.spool is not None:
+            self.spool.close()
+
+    def close(self):
+        """write everything queued and stop the writer thread"""
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            self.queue.put(self.STOP)
+            thread.join()
+            with self.lock:
+                self.thread = None
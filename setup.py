@@ -22,6 +22,7 @@ setup(
         'sqlalchemy',
         'PyYAML',
         'matplotlib',
+        'numpy',
         'scipy',
         'Adafruit_DHT',
         'PyMySQL',
@@ -29,5 +30,5 @@ setup(
         'psutil'
     ],
     zip_safe=True,
-    scripts=["bin/baropi-gatherer", "bin/baropi-server"]
+    scripts=["bin/baropi-gatherer", "bin/baropi-server", "bin/baropi-backfill", "bin/baropi-rollups"]
 )
@@ -23,6 +23,4 @@ def run_test(sensor, pin, delay):
 if __name__ == "__main__":
     b.init_db()
     for sensor in b.cfg.sensors:
-        run_test(sensor['module'], sensor['pin'], sensor['delay'])
-
-    b.run_sensor_thread("DHTSensor", None, 5)
\ No newline at end of file
+        run_test(sensor['module'], sensor['pin'], sensor['delay'])
\ No newline at end of file